@@ -1,10 +1,12 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes.login import router as login_router
 from app.routes.tasa import router as tasa_router
+from app.utils.admission import controller as admission_controller
+from app.utils.auth import get_current_user
 import os
 
 app = FastAPI(
@@ -32,3 +34,8 @@ app.include_router(tasa_router)
 @app.get("/")
 async def root():
     return {"message": "API is running, check /docs for more information"}
+
+@app.get("/api/admission")
+async def admission_stats(current_user: dict = Depends(get_current_user)):
+    """Solicitudes en curso, en cola, admitidas y rechazadas por clase de ruta"""
+    return admission_controller.stats()
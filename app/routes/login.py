@@ -1,5 +1,6 @@
-from fastapi import APIRouter, HTTPException, status, Response
+from fastapi import APIRouter, HTTPException, status, Response, Depends
 from ..utils.auth import authenticate_user, create_access_token
+from ..utils.admission import admission
 from ..models.auth_models import Token, LoginRequest
 from pydantic import Field
 import json
@@ -20,7 +21,8 @@ class LoginResponse(Token):
 @router.post("/api/login", 
     response_model=LoginResponse,
     summary="Autenticación de usuario",
-    responses=docs["auth"]["login"]
+    responses=docs["auth"]["login"],
+    dependencies=[Depends(admission("login", autenticar=False))]
 )
 async def login(credentials: LoginRequest, response: Response):
     """
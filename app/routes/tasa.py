@@ -1,4 +1,7 @@
-from fastapi import APIRouter, HTTPException, Depends, Path, Body, Request
+from fastapi import APIRouter, HTTPException, Depends, Path, Body, Request, Header, Response, Query
+from fastapi.responses import StreamingResponse
+from starlette.datastructures import UploadFile
+from starlette.concurrency import run_in_threadpool
 import httpx
 from ..models import Tasa
 from ..services.google_sheets import (
@@ -7,12 +10,39 @@ from ..services.google_sheets import (
     authenticate_google_sheets,
     SPREADSHEET_ID,
     insert_tasa_in_sheet,
-    delete_tasa_from_sheet
+    delete_tasa_from_sheet,
+    idop_exists_in_sheet,
+    get_shard_for_idop,
+    BulkTasaWriter
+)
+from ..services.snapshot import get_tasas_snapshot, iter_tasas_snapshot, invalidate_snapshot
+from ..services.stats import tasa_stats, get_stats
+from ..services.history import (
+    ensure_history_baseline,
+    record_event,
+    record_upserts,
+    get_tasa_history,
+    get_tasas_as_of,
+    CREATE,
+    UPDATE,
+    DELETE
 )
 from ..utils.auth import get_current_user
-from pydantic import Field, BaseModel, EmailStr, validator, conint
-from typing import List, Dict, Any
+from ..utils.admission import admission
+from ..utils.idempotency import idempotency_store, fingerprint
+from pydantic import Field, BaseModel, EmailStr, validator, conint, ValidationError
+from typing import List, Dict, Any, Optional
+from datetime import datetime
 import json
+import csv
+import io
+import codecs
+import os
+
+# Cantidad de filas por lote al importar CSV (una llamada batchUpdate por shard y lote)
+TASAS_IMPORT_CHUNK_SIZE = int(os.getenv('TASAS_IMPORT_CHUNK_SIZE', '500'))
+# Máximo de filas rechazadas detalladas en la respuesta de la importación
+MAX_ERRORES_IMPORTACION = 100
 
 # Cargar documentación
 with open('app/docs/documentacion.json') as f:
@@ -67,12 +97,20 @@ class NuevaTasa(BaseModel):
             raise ValueError('La tasa debe ser un número decimal')
         return float(v)
 
+def email_valido(email) -> bool:
+    """Un email válido debe contener @ y al menos un punto en el dominio"""
+    return bool(email) and '@' in email and '.' in email.split('@')[1]
+
 @router.get("",
     response_model=List[TasaResponse],
     summary="Obtener todas las tasas",
-    responses=docs["tasas"]["get"]
+    responses=docs["tasas"]["get"],
+    dependencies=[Depends(admission("read"))]
 )
-async def get_tasas(current_user: str = Depends(get_current_user)):
+async def get_tasas(
+    as_of: Optional[datetime] = Query(None, description="Fecha (ISO 8601) en la que se consultan las tasas"),
+    current_user: str = Depends(get_current_user)
+):
     """
     Obtiene la lista de tasas con emails válidos desde Google Sheets.
 
@@ -85,17 +123,19 @@ async def get_tasas(current_user: str = Depends(get_current_user)):
     - Un email válido debe contener @ y al menos un punto en el dominio
     - Si existen múltiples registros con el mismo ID de operación, solo se retorna el primero encontrado
     - El orden de los registros se mantiene según aparecen en la hoja de cálculo
+    - Con as_of se retornan las tasas vigentes en esa fecha según el historial de cambios,
+      ordenadas por ID de operación y sin consultar Google Sheets
     """
     try:
-        tasas = get_tasas_from_sheet()
+        if as_of is not None:
+            tasas = await run_in_threadpool(get_tasas_as_of, as_of)
+        else:
+            tasas = await run_in_threadpool(get_tasas_snapshot)
         if not tasas:
             raise HTTPException(status_code=404, detail="No se encontraron tasas")
         
         # Filtrar solo las tasas con emails válidos
-        tasas_validas = [
-            tasa for tasa in tasas 
-            if tasa.get('email') and '@' in tasa['email'] and '.' in tasa['email'].split('@')[1]
-        ]
+        tasas_validas = [tasa for tasa in tasas if email_valido(tasa.get('email'))]
         
         if not tasas_validas:
             raise HTTPException(status_code=404, detail="No se encontraron tasas con emails válidos")
@@ -112,10 +152,13 @@ async def get_tasas(current_user: str = Depends(get_current_user)):
 @router.post("/create",
     response_model=dict,
     summary="Agregar un nuevo registro",
-    responses=docs["tasas"]["new"]
+    responses=docs["tasas"]["new"],
+    dependencies=[Depends(admission("mutation"))]
 )
 async def crear_tasa(
     tasa: NuevaTasa,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user: str = Depends(get_current_user)
 ):
     """
@@ -126,35 +169,296 @@ async def crear_tasa(
     - El registro se agregará en la primera fila vacía encontrada en la hoja
     - Se considera fila vacía aquella que no tiene datos o solo tiene espacios en blanco
     - Si no hay filas vacías, se agregará al final de la hoja
+    - Si se envía el header Idempotency-Key, los reintentos con la misma clave
+      retornan la respuesta original sin volver a escribir en la hoja
+    - Para que un reintento se reconozca aunque lo atienda otro worker se requiere
+      el directorio compartido IDEMPOTENCY_PATH; sin él, cada worker solo reconoce
+      las claves que recibió
     """
-    try:
-        # Verificar que el ID no exista
-        tasas_existentes = get_tasas_from_sheet()
-        if any(t['idOp'] == tasa.idOp for t in tasas_existentes):
+    async def operacion():
+        try:
+            # Verificar que el ID no exista en ningún shard
+            if await run_in_threadpool(idop_exists_in_sheet, tasa.idOp):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"El ID de operación {tasa.idOp} ya existe"
+                )
+
+            # Insertar la nueva tasa
+            await run_in_threadpool(ensure_history_baseline)
+            resultado = await run_in_threadpool(insert_tasa_in_sheet, tasa)
+            epoch = await run_in_threadpool(invalidate_snapshot)
+            tasa_stats.upsert(tasa.idOp, tasa.tasa, str(tasa.email), epoch=epoch)
+            await run_in_threadpool(record_event, CREATE, tasa.idOp, tasa.tasa, str(tasa.email))
+            return resultado
+        
+        except HTTPException as he:
+            raise he
+        except Exception as e:
             raise HTTPException(
-                status_code=400,
-                detail=f"El ID de operación {tasa.idOp} ya existe"
+                status_code=500,
+                detail=f"Error al agregar el registro: {str(e)}"
             )
 
-        # Insertar la nueva tasa
-        return insert_tasa_in_sheet(tasa)
+    resultado, repetida = await idempotency_store.run(
+        idempotency_key,
+        current_user["username"],
+        fingerprint("create", tasa.dict()),
+        operacion
+    )
+    if repetida:
+        response.headers["Idempotent-Replayed"] = "true"
+    return resultado
         
+@router.get("/stats",
+    response_model=dict,
+    summary="Obtener estadísticas agregadas de las tasas",
+    responses=docs["tasas"]["stats"],
+    dependencies=[Depends(admission("read"))]
+)
+async def get_tasas_stats(
+    group_by: Optional[str] = Query(None, description="Agrupación opcional: email_domain"),
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Obtiene cantidad, promedio, mínimo, máximo y percentiles de las tasas con emails válidos.
+    Requiere autenticación mediante token JWT.
+
+    Note:
+    - Los agregados se calculan una vez por snapshot y se actualizan con cada
+      creación, actualización o eliminación realizada a través de la API
+    - Para que todos los workers respondan lo mismo se requiere el snapshot compartido
+      (TASAS_SNAPSHOT_PATH); sin él, cada worker solo ve sus propias modificaciones
+      hasta que vence TASAS_STATS_TTL
+    - Con group_by=email_domain se incluyen además los agregados por dominio del email
+    """
+    if group_by is not None and group_by != "email_domain":
+        raise HTTPException(
+            status_code=400,
+            detail="El parámetro group_by solo admite el valor email_domain"
+        )
+    try:
+        return await run_in_threadpool(get_stats, group_by)
     except HTTPException as he:
         raise he
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"Error al agregar el registro: {str(e)}"
-        ) 
-        
+            detail=f"Error al obtener las estadísticas: {str(e)}"
+        )
+
+def generar_csv(tasas):
+    """Genera el CSV de tasas por bloques de texto, sin acumular el archivo completo"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["idOp", "tasa", "email"])
+
+    for i, tasa in enumerate(tasas, start=1):
+        if not email_valido(tasa.get('email')):
+            continue
+        writer.writerow([tasa['idOp'], tasa['tasa'], tasa['email']])
+        if i % 1000 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    yield buffer.getvalue()
+
+@router.get("/export.csv",
+    summary="Exportar las tasas en formato CSV",
+    response_class=StreamingResponse,
+    responses=docs["tasas"]["export"],
+    dependencies=[Depends(admission("bulk"))]
+)
+async def exportar_tasas_csv(current_user: str = Depends(get_current_user)):
+    """
+    Exporta las tasas con emails válidos como un archivo CSV.
+    Requiere autenticación mediante token JWT.
+
+    Note:
+    - Las filas se envían a medida que se generan, sin construir el archivo completo en memoria
+    - Se aplican los mismos filtros que en el listado de tasas
+    """
+    try:
+        tasas = await run_in_threadpool(iter_tasas_snapshot)
+        return StreamingResponse(
+            generar_csv(tasas),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="tasas.csv"'}
+        )
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al exportar las tasas: {str(e)}"
+        )
+
+def error_importacion(status_code: int, mensaje: str, numero_fila: int, resumen: Dict[str, Any]) -> HTTPException:
+    """Error de importación que informa lo que alcanzó a escribirse antes de detenerse"""
+    return HTTPException(
+        status_code=status_code,
+        detail={
+            "message": f"{mensaje}. La importación se detuvo en la fila {numero_fila}; "
+                       "las filas del resumen ya quedaron escritas",
+            "resumen": resumen
+        }
+    )
+
+def importar_csv(archivo) -> Dict[str, Any]:
+    """
+    Lee el CSV fila a fila, valida cada fila con las reglas de NuevaTasa y
+    escribe las filas válidas en lotes de TASAS_IMPORT_CHUNK_SIZE.
+
+    Si la importación se interrumpe, el error incluye el resumen de lo que
+    alcanzó a escribirse.
+    """
+    reader = csv.reader(codecs.iterdecode(archivo, 'utf-8-sig'))
+
+    encabezados = next(reader, None)
+    if not encabezados:
+        raise HTTPException(status_code=400, detail="El archivo CSV está vacío")
+
+    columnas = {h.lower().strip(): i for i, h in enumerate(encabezados)}
+    faltantes = [c for c in ('idop', 'tasa', 'email') if c not in columnas]
+    if faltantes:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Columnas faltantes en el CSV: {', '.join(faltantes)}"
+        )
+
+    ensure_history_baseline()
+    writer = BulkTasaWriter()
+    resumen = {"insertados": 0, "actualizados": 0, "sin_cambios": 0, "rechazados": 0, "errores": []}
+    lote = []
+
+    def rechazar(numero_fila, errores):
+        resumen['rechazados'] += 1
+        if len(resumen['errores']) < MAX_ERRORES_IMPORTACION:
+            resumen['errores'].append({"fila": numero_fila, "errores": errores})
+
+    def escribir_lote():
+        try:
+            writer.write_chunk(lote, resumen)
+        finally:
+            # Solo se registran las tasas de los shards que confirmaron la escritura
+            for tasa in writer.escritas:
+                tasa_stats.upsert(tasa.idOp, tasa.tasa, str(tasa.email))
+            record_upserts([(tasa.idOp, tasa.tasa, str(tasa.email)) for tasa in writer.escritas])
+            writer.escritas.clear()
+        lote.clear()
+
+    numero_fila = 1
+    try:
+        for numero_fila, row in enumerate(reader, start=2):
+            if not any(cell.strip() for cell in row):
+                continue
+            try:
+                tasa = NuevaTasa(
+                    idOp=row[columnas['idop']].strip() if len(row) > columnas['idop'] else None,
+                    tasa=row[columnas['tasa']].strip() if len(row) > columnas['tasa'] else None,
+                    email=row[columnas['email']].strip() if len(row) > columnas['email'] else None
+                )
+            except ValidationError as e:
+                rechazar(numero_fila, [str(error.get("msg", "")) for error in e.errors()])
+                continue
+
+            # Las filas sin shard se rechazan aquí, antes de llegar a un lote
+            try:
+                get_shard_for_idop(tasa.idOp)
+            except HTTPException as he:
+                rechazar(numero_fila, [he.detail])
+                continue
+
+            lote.append(tasa)
+            if len(lote) >= TASAS_IMPORT_CHUNK_SIZE:
+                escribir_lote()
+
+        if lote:
+            escribir_lote()
+
+    except UnicodeDecodeError:
+        raise error_importacion(
+            400, "El archivo CSV debe estar codificado en UTF-8", numero_fila, resumen
+        )
+    except HTTPException as he:
+        raise error_importacion(he.status_code, he.detail, numero_fila, resumen)
+    except Exception as e:
+        raise error_importacion(500, f"Error al importar las tasas: {str(e)}", numero_fila, resumen)
+
+    return resumen
+
+@router.post("/import",
+    response_model=dict,
+    summary="Importar tasas desde un archivo CSV",
+    responses=docs["tasas"]["import"],
+    dependencies=[Depends(admission("bulk"))],
+    # El archivo se lee dentro del endpoint (ver nota), por lo que el cuerpo se documenta aquí
+    openapi_extra={"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": ["archivo"],
+        "properties": {"archivo": {
+            "type": "string",
+            "format": "binary",
+            "description": "CSV con columnas idOp, tasa y email"
+        }}
+    }}}}}
+)
+async def importar_tasas_csv(
+    request: Request,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Importa tasas de forma masiva desde un archivo CSV.
+    Requiere autenticación mediante token JWT.
+
+    Note:
+    - Cada fila se valida con las mismas reglas que la creación de un registro
+    - Si el ID de operación ya existe se actualizan su tasa y email, si no, se agrega al final de la hoja
+    - Las escrituras se envían a Google Sheets en lotes de tamaño fijo
+    - Las filas inválidas, o cuyo ID no pertenece a ningún shard, se rechazan sin detener la importación
+    - Si la importación se interrumpe, el error incluye el resumen de lo ya escrito
+    - El archivo se recibe recién después de validar el token y obtener un cupo de la
+      clase bulk: una importación rechazada por saturación (503) no llega a subirse
+    """
+    # Declarar el archivo como parámetro haría que FastAPI recibiera el formulario
+    # completo antes de resolver las dependencias de autenticación y admisión
+    form = await request.form()
+    archivo = form.get("archivo")
+    if not isinstance(archivo, UploadFile):
+        await form.close()
+        raise HTTPException(
+            status_code=400,
+            detail="Debe adjuntar el archivo CSV en el campo 'archivo'"
+        )
+
+    try:
+        resumen = await run_in_threadpool(importar_csv, archivo.file)
+        await run_in_threadpool(invalidate_snapshot)
+        return resumen
+    except HTTPException as he:
+        await run_in_threadpool(invalidate_snapshot)
+        raise he
+    except Exception as e:
+        await run_in_threadpool(invalidate_snapshot)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al importar las tasas: {str(e)}"
+        )
+    finally:
+        await form.close()
+
 @router.post("/{idOp}", 
     response_model=dict,
     summary="Actualizar una tasa de un ID operación existente",
-    responses=docs["tasas"]["update"]
+    responses=docs["tasas"]["update"],
+    dependencies=[Depends(admission("mutation"))]
 )
 async def update_tasa(
+    response: Response,
     idOp: int = Path(..., description="ID de la operación a actualizar"),
     tasa_update: dict = Body(..., example={"tasa": 10.01, "email": "ejemplo@xepelin.com"}),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user: str = Depends(get_current_user)
 ):
     """
@@ -163,66 +467,122 @@ async def update_tasa(
 
     Este endpoint actualiza el valor de una tasa en Google Sheets y
     envía una notificación a través de Zapier cuando la actualización es exitosa.
+    Si se envía el header Idempotency-Key, los reintentos con la misma clave
+    retornan la respuesta original sin volver a escribir ni notificar. Para que
+    esto se cumpla aunque el reintento lo atienda otro worker se requiere el
+    directorio compartido IDEMPOTENCY_PATH; sin él, cada worker solo reconoce
+    las claves que recibió.
     """
-    try:
-        # Validar tasa
-        if tasa_update["tasa"] < 0:
-            raise HTTPException(
-                status_code=400,
-                detail="La tasa no puede ser un número negativo"
-            )
-        
-        # Crear objeto Tasa completo
-        tasa_completa = {
-            "idOp": idOp,
-            "tasa": tasa_update["tasa"],
-            "email": tasa_update["email"]
-        }
+    async def operacion():
+        try:
+            # Validar tasa
+            if tasa_update["tasa"] < 0:
+                raise HTTPException(
+                    status_code=400,
+                    detail="La tasa no puede ser un número negativo"
+                )
         
-        result = update_tasa_in_sheet(tasa_completa)
+            # Crear objeto Tasa completo
+            tasa_completa = {
+                "idOp": idOp,
+                "tasa": tasa_update["tasa"],
+                "email": tasa_update["email"]
+            }
         
-        if result is None:
-            raise HTTPException(
-                status_code=404, 
-                detail=f"idOp {idOp} no encontrado en Google Sheets"
-            )
+            await run_in_threadpool(ensure_history_baseline)
+            result = await run_in_threadpool(update_tasa_in_sheet, tasa_completa)
         
-        elif result is False:
-            return {
-                "message": f"La tasa para idOp {idOp} ya es la misma, no se actualizó."
-            }
+            if result is None:
+                raise HTTPException(
+                    status_code=404, 
+                    detail=f"idOp {idOp} no encontrado en Google Sheets"
+                )
         
-        # Enviar notificación a Zapier
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://hooks.zapier.com/hooks/catch/6872019/oahrt5g/",
-                json={
-                    'idOp': idOp,
-                    'tasa': tasa_update["tasa"],
-                    'email': tasa_update["email"]
+            elif result is False:
+                return {
+                    "message": f"La tasa para idOp {idOp} ya es la misma, no se actualizó."
                 }
-            )
-            
-            if response.status_code == 200:
-                return {"message": "Tasa actualizada correctamente y notificación enviada"}
-            else:
-                raise HTTPException(
-                    status_code=500, 
-                    detail="Error al enviar la notificación a Zapier"
+        
+            epoch = await run_in_threadpool(invalidate_snapshot)
+            tasa_stats.upsert(idOp, tasa_update["tasa"], epoch=epoch)
+            await run_in_threadpool(record_event, UPDATE, idOp, tasa_update["tasa"])
+        
+            # Enviar notificación a Zapier
+            async with httpx.AsyncClient() as client:
+                respuesta_zapier = await client.post(
+                    "https://hooks.zapier.com/hooks/catch/6872019/oahrt5g/",
+                    json={
+                        'idOp': idOp,
+                        'tasa': tasa_update["tasa"],
+                        'email': tasa_update["email"]
+                    }
                 )
+            
+                if respuesta_zapier.status_code == 200:
+                    return {"message": "Tasa actualizada correctamente y notificación enviada"}
+                else:
+                    raise HTTPException(
+                        status_code=500, 
+                        detail="Error al enviar la notificación a Zapier"
+                    )
                 
+        except HTTPException as he:
+            raise he
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error inesperado: {str(e)}"
+            )
+
+    resultado, repetida = await idempotency_store.run(
+        idempotency_key,
+        current_user["username"],
+        fingerprint("update", idOp, tasa_update),
+        operacion
+    )
+    if repetida:
+        response.headers["Idempotent-Replayed"] = "true"
+    return resultado
+
+@router.get("/{idOp}/history",
+    response_model=List[dict],
+    summary="Obtener el historial de cambios de un ID operación",
+    responses=docs["tasas"]["history"],
+    dependencies=[Depends(admission("read"))]
+)
+async def get_historial_tasa(
+    idOp: int = Path(..., description="ID de la operación", gt=0),
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Obtiene los cambios registrados para un ID de operación, del más antiguo al más reciente.
+    Requiere autenticación mediante token JWT.
+
+    Note:
+    - Se responde desde el historial local de cambios, sin consultar Google Sheets
+    - El primer registro de cada ID corresponde al estado inicial ("seed") o a su creación
+    """
+    try:
+        historial = await run_in_threadpool(get_tasa_history, idOp)
+        if not historial:
+            raise HTTPException(
+                status_code=404,
+                detail=f"No se encontró historial para el ID {idOp}"
+            )
+        return historial
     except HTTPException as he:
         raise he
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"Error inesperado: {str(e)}"
-        ) 
+            detail=f"Error al obtener el historial: {str(e)}"
+        )
 
 @router.delete("/{idOp}",
     response_model=dict,
     summary="Eliminar un id operación existente",
-    responses=docs["tasas"]["delete"]
+    responses=docs["tasas"]["delete"],
+    dependencies=[Depends(admission("mutation"))]
 )
 async def delete_tasa(
     idOp: int = Path(..., description="ID de la operación a eliminar", gt=0),
@@ -233,7 +593,12 @@ async def delete_tasa(
     Requiere autenticación mediante token JWT.
     """
     try:
-        return delete_tasa_from_sheet(idOp)
+        await run_in_threadpool(ensure_history_baseline)
+        resultado = await run_in_threadpool(delete_tasa_from_sheet, idOp)
+        epoch = await run_in_threadpool(invalidate_snapshot)
+        tasa_stats.delete(idOp, epoch=epoch)
+        await run_in_threadpool(record_event, DELETE, idOp)
+        return resultado
     except HTTPException as he:
         raise he
     except Exception as e:
@@ -1,5 +1,6 @@
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
@@ -8,6 +9,13 @@ from fastapi import HTTPException
 # Eliminar las variables que ya no usaremos
 SPREADSHEET_ID = os.getenv('SPREADSHEET_ID')
 
+# Configuración de shards: lista JSON de {"spreadsheet_id", "tab", "min_id", "max_id"}.
+# Si no se define, se usa una única hoja 'tasas' en SPREADSHEET_ID.
+TASAS_SHARDS = os.getenv('TASAS_SHARDS')
+# Estrategia de ruteo de idOp a shard: 'hash' (idOp % n) o 'range' (min_id/max_id)
+TASAS_SHARD_STRATEGY = os.getenv('TASAS_SHARD_STRATEGY', 'hash').lower()
+SHARD_STRATEGIES = ('hash', 'range')
+
 def authenticate_google_sheets():
     try:
         # Obtener las credenciales desde la variable de entorno
@@ -40,6 +48,155 @@ def authenticate_google_sheets():
             detail=f"Error de autenticación con Google Sheets: {str(e)}"
         )
 
+def load_shards():
+    """
+    Carga la configuración de shards desde la variable de entorno TASAS_SHARDS.
+
+    Returns:
+        list: Lista de shards, cada uno con spreadsheet_id, tab, min_id y max_id
+
+    Raises:
+        ValueError: Si la configuración no es un JSON válido, está incompleta,
+            la estrategia es desconocida o los rangos son inválidos o se solapan
+    """
+    if TASAS_SHARD_STRATEGY not in SHARD_STRATEGIES:
+        raise ValueError(
+            f"TASAS_SHARD_STRATEGY debe ser una de {', '.join(SHARD_STRATEGIES)} (se recibió \"{TASAS_SHARD_STRATEGY}\")"
+        )
+
+    if not TASAS_SHARDS:
+        return [{
+            "spreadsheet_id": SPREADSHEET_ID,
+            "tab": "tasas",
+            "min_id": None,
+            "max_id": None
+        }]
+
+    try:
+        config = json.loads(TASAS_SHARDS)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"TASAS_SHARDS no es un JSON válido: {str(e)}")
+
+    if not isinstance(config, list) or not config:
+        raise ValueError("TASAS_SHARDS debe ser una lista con al menos un shard")
+
+    shards = []
+    for i, shard in enumerate(config):
+        if not isinstance(shard, dict):
+            raise ValueError(f"TASAS_SHARDS[{i}] debe ser un objeto JSON")
+
+        tab = shard.get("tab", "tasas")
+        if not isinstance(tab, str) or not tab.strip() or '!' in tab:
+            raise ValueError(
+                f"TASAS_SHARDS[{i}].tab debe ser el nombre de una pestaña, sin rango (por ejemplo \"tasas\")"
+            )
+
+        spreadsheet_id = shard.get("spreadsheet_id", SPREADSHEET_ID)
+        if not spreadsheet_id:
+            raise ValueError(f"TASAS_SHARDS[{i}] no define spreadsheet_id y SPREADSHEET_ID no está configurado")
+
+        for limite in ("min_id", "max_id"):
+            if shard.get(limite) is not None and not isinstance(shard[limite], int):
+                raise ValueError(f"TASAS_SHARDS[{i}].{limite} debe ser un número entero")
+
+        if shard.get("min_id") is not None and shard.get("max_id") is not None and shard["min_id"] > shard["max_id"]:
+            raise ValueError(f"TASAS_SHARDS[{i}]: min_id no puede ser mayor que max_id")
+
+        shards.append({
+            "spreadsheet_id": spreadsheet_id,
+            "tab": tab,
+            "min_id": shard.get("min_id"),
+            "max_id": shard.get("max_id")
+        })
+
+    if TASAS_SHARD_STRATEGY == 'range' and len(shards) > 1:
+        validate_ranges(shards)
+    return shards
+
+def validate_ranges(shards):
+    """
+    Verifica que, con la estrategia 'range', cada shard defina al menos un
+    límite y que los rangos no se solapen (un idOp debe tener un único shard).
+    """
+    for i, shard in enumerate(shards):
+        if shard['min_id'] is None and shard['max_id'] is None:
+            raise ValueError(f"TASAS_SHARDS[{i}] debe definir min_id o max_id con la estrategia 'range'")
+
+    ordenados = sorted(
+        range(len(shards)),
+        key=lambda i: shards[i]['min_id'] if shards[i]['min_id'] is not None else float('-inf')
+    )
+    for anterior, siguiente in zip(ordenados, ordenados[1:]):
+        fin = shards[anterior]['max_id']
+        inicio = shards[siguiente]['min_id']
+        if fin is None or inicio is None or inicio <= fin:
+            raise ValueError(f"Los rangos de TASAS_SHARDS[{anterior}] y TASAS_SHARDS[{siguiente}] se solapan")
+
+def a1_range(shard, celdas=None):
+    """
+    Construye un rango A1 para la pestaña del shard, citando el nombre para
+    admitir espacios y otros caracteres especiales.
+    """
+    tab = "'" + shard['tab'].replace("'", "''") + "'"
+    return f"{tab}!{celdas}" if celdas else tab
+
+SHARDS = load_shards()
+
+def get_shard_for_idop(idOp: int):
+    """
+    Obtiene el shard donde debe vivir un idOp según la estrategia configurada.
+
+    Args:
+        idOp: ID de la operación
+
+    Returns:
+        dict: Shard con spreadsheet_id y tab
+
+    Raises:
+        HTTPException: Si ningún shard cubre el idOp (estrategia 'range')
+    """
+    if len(SHARDS) == 1:
+        return SHARDS[0]
+
+    if TASAS_SHARD_STRATEGY == 'range':
+        for shard in SHARDS:
+            if shard['min_id'] is not None and idOp < shard['min_id']:
+                continue
+            if shard['max_id'] is not None and idOp > shard['max_id']:
+                continue
+            return shard
+        raise HTTPException(
+            status_code=400,
+            detail=f"El ID de operación {idOp} no pertenece a ningún shard configurado"
+        )
+
+    return SHARDS[idOp % len(SHARDS)]
+
+def get_shard_values(shard):
+    """
+    Obtiene todos los valores (incluyendo encabezados) de un shard.
+    Cada llamada construye su propio cliente, ya que no es seguro compartirlo entre hilos.
+    """
+    service = authenticate_google_sheets()
+    result = service.spreadsheets().values().get(
+        spreadsheetId=shard['spreadsheet_id'],
+        range=a1_range(shard)
+    ).execute()
+    return result.get('values', [])
+
+def get_all_shard_values():
+    """
+    Obtiene los valores de todos los shards en paralelo.
+
+    Returns:
+        list: Valores de cada shard, en el mismo orden que SHARDS
+    """
+    if len(SHARDS) == 1:
+        return [get_shard_values(SHARDS[0])]
+
+    with ThreadPoolExecutor(max_workers=len(SHARDS)) as executor:
+        return list(executor.map(get_shard_values, SHARDS))
+
 def get_column_indices(headers):
     """
     Obtiene los índices de las columnas basándose en los encabezados.
@@ -84,68 +241,130 @@ def get_column_indices(headers):
     return indices
 
 def get_tasas_from_sheet():
+    """
+    Obtiene las tasas de todos los shards, consultándolos en paralelo.
+    Si un idOp aparece más de una vez, se conserva la primera ocurrencia
+    según el orden de los shards y de las filas.
+    """
     try:
-        service = authenticate_google_sheets()
-        sheet = service.spreadsheets()
-        
-        # Obtener todos los datos
-        result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range='tasas').execute()
-        values = result.get('values', [])
-        
-        if not values:
-            return []
-        
-        # Obtener los índices de las columnas desde los encabezados
-        column_indices = get_column_indices(values[0])
-        
         tasas = []
         ids_vistos = set()  # Conjunto para trackear IDs ya procesados
-        
-        for row in values[1:]:  # Saltar el encabezado
-            if len(row) <= max(column_indices.values()):  # Verificar que la fila tenga suficientes columnas
+
+        for values in get_all_shard_values():
+            if not values:
                 continue
-            
-            try:
-                idOp = int(row[column_indices['idOp']])
-                
-                # Si el ID ya fue procesado, saltamos esta fila
-                if idOp in ids_vistos:
-                    continue
-                    
-                tasa = float(row[column_indices['tasa']])
-                email = row[column_indices['email']]
-                
-                # Agregar el ID al conjunto de IDs vistos
-                ids_vistos.add(idOp)
-                
-                tasas.append({
-                    "idOp": idOp,
-                    "tasa": tasa,
-                    "email": email
-                })
-                
-            except (ValueError, IndexError) as e:
-                continue  # Omitir filas con datos inválidos
-        
+            tasas.extend(parse_tasas(values, ids_vistos))
+
         return tasas
     except HttpError as err:
         raise HTTPException(
             status_code=500,
             detail=f"Error al acceder a Google Sheets: {str(err)}"
         )
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error inesperado: {str(e)}"
         )
 
+def iter_tasas_from_sheet():
+    """
+    Como get_tasas_from_sheet, pero cada tasa se construye al iterar a partir
+    de las filas de los shards, sin armar la lista completa. Las filas se leen
+    y los encabezados se validan antes de retornar, para que los errores de
+    acceso se reporten antes de comenzar a iterar.
+    """
+    try:
+        shard_values = [values for values in get_all_shard_values() if values]
+        for values in shard_values:
+            get_column_indices(values[0])
+    except HttpError as err:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al acceder a Google Sheets: {str(err)}"
+        )
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error inesperado: {str(e)}"
+        )
+
+    def generar():
+        ids_vistos = set()
+        for values in shard_values:
+            yield from iter_parse_tasas(values, ids_vistos)
+
+    return generar()
+
+def parse_tasas(values, ids_vistos):
+    """
+    Convierte las filas de un shard en tasas, omitiendo filas inválidas
+    y los idOp presentes en ids_vistos (que se actualiza en el proceso).
+    """
+    return list(iter_parse_tasas(values, ids_vistos))
+
+def iter_parse_tasas(values, ids_vistos):
+    """Versión generadora de parse_tasas: cada tasa se construye al iterar"""
+    # Obtener los índices de las columnas desde los encabezados
+    column_indices = get_column_indices(values[0])
+
+    for row in values[1:]:  # Saltar el encabezado
+        if len(row) <= max(column_indices.values()):  # Verificar que la fila tenga suficientes columnas
+            continue
+
+        try:
+            idOp = int(row[column_indices['idOp']])
+
+            # Si el ID ya fue procesado, saltamos esta fila
+            if idOp in ids_vistos:
+                continue
+
+            tasa = float(row[column_indices['tasa']])
+            email = row[column_indices['email']]
+
+            # Agregar el ID al conjunto de IDs vistos
+            ids_vistos.add(idOp)
+
+            yield {
+                "idOp": idOp,
+                "tasa": tasa,
+                "email": email
+            }
+
+        except (ValueError, IndexError) as e:
+            continue  # Omitir filas con datos inválidos
+
+def idop_exists_in_sheet(idOp: int):
+    """
+    Verifica si un idOp ya existe en cualquier shard (consultados en paralelo).
+    No basta con el shard que le corresponde: si cambió la cantidad de shards
+    o una fila quedó en otro, insertarlo crearía un duplicado que las lecturas
+    ocultarían.
+    """
+    try:
+        return any(
+            t['idOp'] == idOp
+            for values in get_all_shard_values() if values
+            for t in parse_tasas(values, set())
+        )
+    except HttpError as err:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al acceder a Google Sheets: {str(err)}"
+        )
+
 def update_tasa_in_sheet(tasa_data):
     try:
+        shard = get_shard_for_idop(tasa_data['idOp'])
         service = authenticate_google_sheets()
         sheet = service.spreadsheets()
         
         # Obtener todos los valores de la hoja
-        result = sheet.values().get(spreadsheetId=SPREADSHEET_ID, range='tasas').execute()
+        result = sheet.values().get(spreadsheetId=shard['spreadsheet_id'], range=a1_range(shard)).execute()
         values = result.get('values', [])
         
         # Obtener los índices de las columnas
@@ -164,12 +383,12 @@ def update_tasa_in_sheet(tasa_data):
                     
                     # Actualizar la tasa en la columna correcta
                     column_letter = chr(65 + column_indices['tasa'])  # Convertir índice a letra de columna
-                    range_name = f'tasas!{column_letter}{i+1}'  # +1 porque i empieza desde 1
+                    range_name = a1_range(shard, f"{column_letter}{i+1}")  # +1 porque i empieza desde 1
                     body = {
                         'values': [[tasa_data['tasa']]]
                     }
                     sheet.values().update(
-                        spreadsheetId=SPREADSHEET_ID,
+                        spreadsheetId=shard['spreadsheet_id'],
                         range=range_name,
                         valueInputOption='RAW',
                         body=body
@@ -180,6 +399,8 @@ def update_tasa_in_sheet(tasa_data):
                 
         return None  # idOp no encontrado
         
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -200,13 +421,14 @@ def insert_tasa_in_sheet(tasa_data):
         HTTPException: Si hay error en la inserción o validación
     """
     try:
+        shard = get_shard_for_idop(tasa_data.idOp)
         service = authenticate_google_sheets()
         sheet = service.spreadsheets()
         
         # Obtener todos los valores
         result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range='tasas'
+            spreadsheetId=shard['spreadsheet_id'],
+            range=a1_range(shard)
         ).execute()
         values = result.get('values', [])
         
@@ -237,13 +459,13 @@ def insert_tasa_in_sheet(tasa_data):
         nueva_fila[column_indices['email']] = str(tasa_data.email)
         
         # Insertar en la primera fila vacía encontrada
-        range_name = f'tasas!A{primera_fila_vacia}'
+        range_name = a1_range(shard, f"A{primera_fila_vacia}")
         body = {
             'values': [nueva_fila]
         }
         
         sheet.values().update(
-            spreadsheetId=SPREADSHEET_ID,
+            spreadsheetId=shard['spreadsheet_id'],
             range=range_name,
             valueInputOption='RAW',
             body=body
@@ -259,22 +481,147 @@ def insert_tasa_in_sheet(tasa_data):
             detail=f"Error al agregar el registro: {str(e)}"
         ) 
 
+class BulkTasaWriter:
+    """
+    Escribe lotes de tasas en los shards correspondientes usando una única
+    llamada batchUpdate por shard y por lote. Cada shard se lee solo una vez,
+    la primera vez que se le escribe, para conocer sus encabezados y filas.
+
+    Las tasas cuyos lotes ya quedaron escritos se acumulan en `escritas`, para
+    que quien llama sepa qué se confirmó aunque un lote falle a mitad de camino.
+    """
+
+    def __init__(self):
+        self.service = authenticate_google_sheets()
+        self.estados = {}
+        self.escritas = []
+
+    def get_estado(self, shard):
+        clave = (shard['spreadsheet_id'], shard['tab'])
+        if clave not in self.estados:
+            values = get_shard_values(shard)
+            if not values:
+                raise HTTPException(
+                    status_code=500,
+                    detail="No se encontraron datos en la hoja, incluyendo los headers"
+                )
+            column_indices = get_column_indices(values[0])
+
+            filas = {}
+            for i, row in enumerate(values[1:], start=2):
+                if len(row) <= max(column_indices.values()):
+                    continue
+                try:
+                    idOp = int(row[column_indices['idOp']])
+                    if idOp not in filas:
+                        filas[idOp] = (i, float(row[column_indices['tasa']]), row[column_indices['email']])
+                except (ValueError, IndexError):
+                    continue
+
+            self.estados[clave] = {
+                "column_indices": column_indices,
+                "ancho": len(values[0]),
+                "filas": filas,
+                "siguiente_fila": len(values) + 1
+            }
+        return self.estados[clave]
+
+    def write_chunk(self, tasas, resumen):
+        """
+        Inserta o actualiza un lote de tasas.
+
+        Args:
+            tasas: Lista de objetos con idOp, tasa y email
+            resumen: Contadores de insertados, actualizados y sin cambios; se
+                actualizan a medida que cada shard confirma su escritura
+        """
+        por_shard = {}
+        for tasa_data in tasas:
+            shard = get_shard_for_idop(tasa_data.idOp)
+            por_shard.setdefault((shard['spreadsheet_id'], shard['tab']), (shard, []))[1].append(tasa_data)
+
+        try:
+            for shard, tasas_shard in por_shard.values():
+                estado = self.get_estado(shard)
+                column_indices = estado['column_indices']
+                data = []
+                conteo = {"insertados": 0, "actualizados": 0, "sin_cambios": 0}
+
+                for tasa_data in tasas_shard:
+                    email = str(tasa_data.email)
+                    existente = estado['filas'].get(tasa_data.idOp)
+
+                    if existente is None:
+                        fila = estado['siguiente_fila']
+                        estado['siguiente_fila'] += 1
+                        nueva_fila = [""] * estado['ancho']
+                        nueva_fila[column_indices['idOp']] = str(tasa_data.idOp)
+                        nueva_fila[column_indices['tasa']] = str(tasa_data.tasa)
+                        nueva_fila[column_indices['email']] = email
+                        data.append({'range': a1_range(shard, f"A{fila}"), 'values': [nueva_fila]})
+                        conteo['insertados'] += 1
+                    else:
+                        fila, tasa_actual, email_actual = existente
+                        if tasa_actual == tasa_data.tasa and email_actual == email:
+                            conteo['sin_cambios'] += 1
+                            continue
+                        for columna, valor in (('tasa', tasa_data.tasa), ('email', email)):
+                            column_letter = chr(65 + column_indices[columna])
+                            data.append({'range': a1_range(shard, f"{column_letter}{fila}"), 'values': [[valor]]})
+                        conteo['actualizados'] += 1
+
+                    estado['filas'][tasa_data.idOp] = (fila, tasa_data.tasa, email)
+
+                if data:
+                    self.service.spreadsheets().values().batchUpdate(
+                        spreadsheetId=shard['spreadsheet_id'],
+                        body={'valueInputOption': 'RAW', 'data': data}
+                    ).execute()
+
+                for clave, cantidad in conteo.items():
+                    resumen[clave] += cantidad
+                self.escritas.extend(tasas_shard)
+
+        except HTTPException as he:
+            raise he
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al importar el lote en Google Sheets: {str(e)}"
+            )
+
+def get_sheet_id(spreadsheet, tab):
+    """
+    Obtiene el sheetId de la pestaña cuyo título coincide con tab.
+
+    Raises:
+        HTTPException: Si la pestaña no existe, para no operar sobre otra hoja
+    """
+    for hoja in spreadsheet['sheets']:
+        if hoja['properties']['title'] == tab:
+            return hoja['properties']['sheetId']
+    raise HTTPException(
+        status_code=500,
+        detail=f"No se encontró la pestaña '{tab}' en la hoja de cálculo"
+    )
+
 def delete_tasa_from_sheet(idOp: int):
     """
     Elimina una tasa de Google Sheets basado en el idOp.
     """
     try:
+        shard = get_shard_for_idop(idOp)
         service = authenticate_google_sheets()
         sheet = service.spreadsheets()
         
-        # Obtener el spreadsheet para obtener el sheet ID
-        spreadsheet = sheet.get(spreadsheetId=SPREADSHEET_ID).execute()
-        sheet_id = spreadsheet['sheets'][0]['properties']['sheetId']
+        # Obtener el spreadsheet para obtener el sheet ID de la pestaña del shard
+        spreadsheet = sheet.get(spreadsheetId=shard['spreadsheet_id']).execute()
+        sheet_id = get_sheet_id(spreadsheet, shard['tab'])
         
         # Obtener todos los valores
         result = sheet.values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range='tasas'
+            spreadsheetId=shard['spreadsheet_id'],
+            range=a1_range(shard)
         ).execute()
         values = result.get('values', [])
         
@@ -324,7 +671,7 @@ def delete_tasa_from_sheet(idOp: int):
         
         # Ejecutar la solicitud de eliminación
         sheet.batchUpdate(
-            spreadsheetId=SPREADSHEET_ID,
+            spreadsheetId=shard['spreadsheet_id'],
             body=request
         ).execute()
         
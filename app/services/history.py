@@ -0,0 +1,337 @@
+import os
+import math
+import mmap
+import time
+import fcntl
+import bisect
+import struct
+import logging
+import threading
+from datetime import datetime, timezone
+from fastapi import HTTPException
+from .google_sheets import get_tasas_from_sheet
+
+logger = logging.getLogger(__name__)
+
+# Ruta del log de cambios. Si no se define, el historial queda deshabilitado.
+TASAS_HISTORY_PATH = os.getenv('TASAS_HISTORY_PATH')
+
+# Formato del log:
+#   encabezado: magic, versión de formato
+#   registros:  fecha (microsegundos UTC), idOp, tasa, tasa anterior (NaN si no hay),
+#               operación, offset y largo del email en el archivo de emails (tamaño fijo)
+# Los registros se agregan en orden de fecha, por lo que el log completo
+# sirve de índice temporal; los emails se guardan aparte en '<ruta>.emails'.
+MAGIC = b'XTHL'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sH10x')
+RECORD = struct.Struct('<qqddB3xIH2x')
+
+SEED, CREATE, UPDATE, DELETE = 0, 1, 2, 3
+OPERACIONES = {SEED: "seed", CREATE: "create", UPDATE: "update", DELETE: "delete"}
+
+
+def to_micros(fecha: datetime) -> int:
+    """Convierte una fecha a microsegundos UTC (las fechas sin zona se asumen UTC)"""
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return int(fecha.timestamp() * 1_000_000)
+
+
+def from_micros(micros: int) -> str:
+    return datetime.fromtimestamp(micros / 1_000_000, tz=timezone.utc).isoformat()
+
+
+class HistoryLog:
+    """
+    Log de cambios de tasas, de solo agregado y con registros de tamaño fijo.
+
+    Las consultas usan búsqueda binaria: sobre el log para ubicar una fecha y
+    sobre la lista de posiciones de cada idOp (índice en memoria que se
+    extiende a medida que crece el archivo, incluso si escribe otro proceso).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.emails_path = f"{path}.emails"
+        self.lock = threading.Lock()
+        self.mm = None
+        self.emails_mm = None
+        self.cantidad = 0
+        self.posiciones = {}  # idOp -> posiciones de sus registros, en orden
+
+        if not os.path.exists(self.path):
+            with open(self.path, 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                if f.tell() == 0:
+                    f.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+                fcntl.flock(f, fcntl.LOCK_UN)
+            open(self.emails_path, 'ab').close()
+
+    def leer(self, posicion):
+        """Retorna (fecha, idOp, tasa, tasa anterior, operación, offset del email, largo del email)"""
+        return RECORD.unpack_from(self.mm, HEADER.size + posicion * RECORD.size)
+
+    def leer_email(self, offset, largo):
+        if largo == 0:
+            return ""
+        return self.emails_mm[offset:offset + largo].decode('utf-8')
+
+    def sincronizar(self):
+        """Mapea los registros nuevos del archivo y los agrega al índice por idOp"""
+        tamano = os.path.getsize(self.path)
+        cantidad = (tamano - HEADER.size) // RECORD.size
+        if cantidad <= self.cantidad:
+            return
+
+        with open(self.path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), HEADER.size + cantidad * RECORD.size, access=mmap.ACCESS_READ)
+        # Los emails se escriben antes que sus registros, así que el archivo de
+        # emails, medido después del log, cubre todos los registros mapeados
+        with open(self.emails_path, 'rb') as f:
+            tamano_emails = os.fstat(f.fileno()).st_size
+            if tamano_emails:
+                self.emails_mm = mmap.mmap(f.fileno(), tamano_emails, access=mmap.ACCESS_READ)
+
+        magic, version = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Archivo de historial con formato desconocido")
+
+        for posicion in range(self.cantidad, cantidad):
+            idOp = self.leer(posicion)[1]
+            self.posiciones.setdefault(idOp, []).append(posicion)
+        self.cantidad = cantidad
+
+    def ultimo_estado(self, idOp):
+        posiciones = self.posiciones.get(idOp)
+        if not posiciones:
+            return None
+        _, _, tasa, _, operacion, email_offset, email_len = self.leer(posiciones[-1])
+        if operacion == DELETE:
+            return None
+        return tasa, self.leer_email(email_offset, email_len)
+
+    def agregar(self, eventos):
+        """
+        Agrega eventos (operación, idOp, tasa, tasa anterior, email) al final del log bajo un
+        lock de archivo, para que varios procesos puedan escribir a la vez.
+        """
+        with open(self.path, 'r+b') as log, open(self.emails_path, 'ab') as emails:
+            fcntl.flock(log, fcntl.LOCK_EX)
+            try:
+                # Descarta un registro incompleto que pudo dejar una escritura interrumpida
+                tamano = os.fstat(log.fileno()).st_size
+                cantidad = (tamano - HEADER.size) // RECORD.size
+                fin = HEADER.size + cantidad * RECORD.size
+                if tamano != fin:
+                    log.truncate(fin)
+
+                # Las fechas nunca retroceden, así el log queda ordenado por fecha
+                ultimo = RECORD.unpack(os.pread(log.fileno(), RECORD.size, fin - RECORD.size))[0] if cantidad else 0
+                micros = max(int(time.time() * 1_000_000), ultimo)
+
+                registros = bytearray()
+                offset = emails.seek(0, os.SEEK_END)
+                for operacion, idOp, tasa, tasa_anterior, email in eventos:
+                    email = (email or "").encode('utf-8')
+                    emails.write(email)
+                    registros += RECORD.pack(
+                        micros, idOp, tasa, math.nan if tasa_anterior is None else tasa_anterior,
+                        operacion, offset, len(email)
+                    )
+                    offset += len(email)
+                emails.flush()
+                os.fsync(emails.fileno())
+
+                # Los emails se escriben antes que los registros que los referencian
+                log.seek(fin)
+                log.write(registros)
+                log.flush()
+                os.fsync(log.fileno())
+            finally:
+                fcntl.flock(log, fcntl.LOCK_UN)
+
+    def asegurar_base(self):
+        """
+        Si el log está vacío, registra el estado actual de la hoja como punto
+        de partida. Debe llamarse antes de escribir en la hoja, para que la
+        primera modificación registrada conserve el valor anterior.
+        """
+        with self.lock:
+            self.sincronizar()
+            if self.cantidad > 0:
+                return
+            with open(f"{self.path}.lock", 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self.sincronizar()
+                    if self.cantidad == 0:
+                        tasas = get_tasas_from_sheet()
+                        if tasas:
+                            self.agregar([(SEED, t['idOp'], t['tasa'], None, t['email']) for t in tasas])
+                        self.sincronizar()
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def registrar(self, operacion, idOp, tasa=None, email=None):
+        """
+        Registra una modificación junto con la tasa anterior del idOp. Los datos
+        que no se indiquen se toman de su último estado conocido.
+        """
+        with self.lock:
+            self.sincronizar()
+            anterior = self.ultimo_estado(idOp)
+            tasa_anterior = None
+            if anterior is not None:
+                tasa_anterior = anterior[0]
+                tasa = anterior[0] if tasa is None else tasa
+                email = anterior[1] if email is None else email
+            self.agregar([(operacion, idOp, tasa if tasa is not None else math.nan, tasa_anterior, email)])
+            self.sincronizar()
+
+    def registrar_upserts(self, tasas):
+        """
+        Registra un lote de creaciones o actualizaciones con una sola escritura;
+        la operación se deduce del último estado conocido de cada idOp.
+        """
+        with self.lock:
+            self.sincronizar()
+            eventos = []
+            vistos = {}
+            for idOp, tasa, email in tasas:
+                anterior = vistos[idOp] if idOp in vistos else self.ultimo_estado(idOp)
+                if anterior == (tasa, email):
+                    continue
+                if anterior is None:
+                    eventos.append((CREATE, idOp, tasa, None, email))
+                else:
+                    eventos.append((UPDATE, idOp, tasa, anterior[0], email))
+                vistos[idOp] = (tasa, email)
+            if eventos:
+                self.agregar(eventos)
+                self.sincronizar()
+
+    def historial(self, idOp):
+        with self.lock:
+            self.sincronizar()
+            eventos = []
+            for posicion in self.posiciones.get(idOp, []):
+                micros, _, tasa, tasa_anterior, operacion, email_offset, email_len = self.leer(posicion)
+                eventos.append({
+                    "fecha": from_micros(micros),
+                    "operacion": OPERACIONES[operacion],
+                    "tasa": None if math.isnan(tasa) else tasa,
+                    "tasa_anterior": None if math.isnan(tasa_anterior) else tasa_anterior,
+                    "email": self.leer_email(email_offset, email_len)
+                })
+            return eventos
+
+    def estado_en(self, micros):
+        """
+        Reconstruye las tasas vigentes en una fecha: una búsqueda binaria ubica
+        el último registro anterior a la fecha y otra, por cada idOp, su último
+        cambio hasta ese punto. Solo lee el log: nunca consulta Google Sheets.
+        """
+        with self.lock:
+            self.sincronizar()
+
+            inicio, fin = 0, self.cantidad
+            while inicio < fin:
+                medio = (inicio + fin) // 2
+                if self.leer(medio)[0] <= micros:
+                    inicio = medio + 1
+                else:
+                    fin = medio
+            limite = inicio
+
+            tasas = []
+            for idOp in sorted(self.posiciones):
+                posiciones = self.posiciones[idOp]
+                i = bisect.bisect_left(posiciones, limite) - 1
+                if i < 0:
+                    continue
+                _, _, tasa, _, operacion, email_offset, email_len = self.leer(posiciones[i])
+                if operacion == DELETE:
+                    continue
+                tasas.append({
+                    "idOp": idOp,
+                    "tasa": tasa,
+                    "email": self.leer_email(email_offset, email_len)
+                })
+            return tasas
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_history_log():
+    global _log
+    if not TASAS_HISTORY_PATH:
+        raise HTTPException(
+            status_code=503,
+            detail="El historial de tasas no está habilitado (TASAS_HISTORY_PATH)"
+        )
+    with _log_lock:
+        if _log is None:
+            _log = HistoryLog(TASAS_HISTORY_PATH)
+        return _log
+
+
+# Las funciones de escritura se llaman alrededor de modificaciones que ya se
+# hicieron (o se harán) en Google Sheets: un error del historial se registra en
+# el log de la aplicación pero no hace fallar la solicitud.
+
+def ensure_history_baseline():
+    """Registra el estado inicial de la hoja si el log está vacío; llamar antes de modificarla"""
+    if not TASAS_HISTORY_PATH:
+        return
+    try:
+        get_history_log().asegurar_base()
+    except Exception:
+        logger.exception("No se pudo registrar el estado inicial del historial de tasas")
+
+
+def record_event(operacion, idOp, tasa=None, email=None):
+    """Registra una modificación en el historial, si está habilitado"""
+    if not TASAS_HISTORY_PATH:
+        return
+    try:
+        get_history_log().registrar(operacion, idOp, tasa, email)
+    except Exception:
+        logger.exception("No se pudo registrar en el historial la operación %s del idOp %s",
+                         OPERACIONES.get(operacion), idOp)
+
+
+def record_upserts(tasas):
+    """Registra un lote de (idOp, tasa, email) importados, si el historial está habilitado"""
+    if not TASAS_HISTORY_PATH:
+        return
+    try:
+        get_history_log().registrar_upserts(tasas)
+    except Exception:
+        logger.exception("No se pudo registrar en el historial un lote de %s tasas importadas", len(tasas))
+
+
+def get_tasa_history(idOp):
+    try:
+        return get_history_log().historial(idOp)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al leer el historial: {str(e)}"
+        )
+
+
+def get_tasas_as_of(fecha: datetime):
+    try:
+        return get_history_log().estado_en(to_micros(fecha))
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al leer el historial: {str(e)}"
+        )
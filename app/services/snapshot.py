@@ -0,0 +1,303 @@
+import os
+import mmap
+import time
+import fcntl
+import struct
+import threading
+from fastapi import HTTPException
+from .google_sheets import get_tasas_from_sheet, iter_tasas_from_sheet
+
+# Ruta del archivo compartido por los workers. Si no se define, cada proceso
+# lee directamente desde Google Sheets.
+TASAS_SNAPSHOT_PATH = os.getenv('TASAS_SNAPSHOT_PATH')
+# Segundos que un snapshot se considera vigente antes de refrescarlo
+TASAS_SNAPSHOT_TTL = float(os.getenv('TASAS_SNAPSHOT_TTL', '60'))
+
+# Formato del archivo:
+#   encabezado: magic, versión de formato, flags, generación, época de invalidación,
+#               fecha de publicación, cantidad de registros, tamaño del bloque de emails
+#   registros:  idOp, tasa, offset del email, largo del email (tamaño fijo)
+#   emails:     bytes UTF-8 concatenados
+MAGIC = b'XTSN'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sHHQQdII')
+RECORD = struct.Struct('<qdIH2x')
+# Contador de invalidaciones, persistido en '<ruta>.epoch'
+EPOCH = struct.Struct('<Q')
+
+
+class SnapshotView:
+    """
+    Vista de solo lectura sobre un snapshot mapeado en memoria.
+    Los registros se decodifican al iterar, sin copiar el archivo completo.
+    """
+
+    def __init__(self, mm, ino, mtime_ns):
+        magic, version, _, generation, epoch, published_at, count, _ = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Archivo de snapshot con formato desconocido")
+        self.mm = mm
+        self.ino = ino
+        self.mtime_ns = mtime_ns
+        self.generation = generation
+        self.epoch = epoch
+        self.published_at = published_at
+        self.count = count
+        self.emails_start = HEADER.size + count * RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        mm = self.mm
+        for i in range(self.count):
+            idOp, tasa, email_offset, email_len = RECORD.unpack_from(mm, HEADER.size + i * RECORD.size)
+            inicio = self.emails_start + email_offset
+            yield {
+                "idOp": idOp,
+                "tasa": tasa,
+                "email": mm[inicio:inicio + email_len].decode('utf-8')
+            }
+
+    def age(self):
+        return time.time() - self.published_at
+
+
+class SnapshotReader:
+    """
+    Mantiene el mapeo del snapshot vigente y lo reemplaza cuando se publica
+    una nueva versión (el archivo se reemplaza de forma atómica, por lo que
+    cambia su inode).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._view = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        view = self._view
+        if view is not None and view.ino == st.st_ino and view.mtime_ns == st.st_mtime_ns:
+            return view
+
+        with self._lock:
+            view = self._view
+            if view is not None and view.ino == st.st_ino and view.mtime_ns == st.st_mtime_ns:
+                return view
+            try:
+                with open(self.path, 'rb') as f:
+                    fst = os.fstat(f.fileno())
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                return None
+            try:
+                view = SnapshotView(mm, fst.st_ino, fst.st_mtime_ns)
+            except (ValueError, struct.error):
+                return None  # Formato anterior o archivo incompleto: se reconstruye
+            # El mapeo anterior se libera cuando ningún lector lo está usando
+            self._view = view
+            return self._view
+
+
+def write_snapshot(path, tasas, generation, epoch):
+    """
+    Escribe las tasas en un archivo temporal y lo publica de forma atómica.
+    """
+    records = bytearray()
+    emails = bytearray()
+    for tasa in tasas:
+        email = str(tasa['email']).encode('utf-8')
+        records += RECORD.pack(tasa['idOp'], tasa['tasa'], len(emails), len(email))
+        emails += email
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, generation, epoch, time.time(), len(tasas), len(emails))
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(records)
+        f.write(emails)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+
+class EpochFile:
+    """
+    Contador persistido de invalidaciones. Su lock serializa la publicación
+    de un snapshot con las invalidaciones, de modo que un refresco que leyó la
+    hoja antes de una modificación nunca publique datos anteriores a ella.
+
+    La instancia es compartida por los hilos del proceso: un lock de hilos
+    protege el archivo abierto mientras se usa, y el lock de archivo
+    coordina con los demás procesos.
+    """
+
+    def __init__(self, path):
+        self.path = f"{path}.epoch"
+        self.lock = threading.Lock()
+        self.file = None
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        os.close(fd)
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.file = open(self.path, 'r+b')
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        except BaseException:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+        finally:
+            self.file = None
+            self.lock.release()
+
+    def leer(self):
+        datos = os.pread(self.file.fileno(), EPOCH.size, 0)
+        return EPOCH.unpack(datos)[0] if len(datos) == EPOCH.size else 0
+
+    def incrementar(self):
+        epoch = self.leer() + 1
+        os.pwrite(self.file.fileno(), EPOCH.pack(epoch), 0)
+        self.file.flush()
+        return epoch
+
+
+def read_epoch():
+    """Época de invalidación vigente, o None si el snapshot no está habilitado"""
+    if _epoch is None:
+        return None
+    with _epoch as epoch_file:
+        return epoch_file.leer()
+
+
+_reader = SnapshotReader(TASAS_SNAPSHOT_PATH) if TASAS_SNAPSHOT_PATH else None
+_epoch = EpochFile(TASAS_SNAPSHOT_PATH) if TASAS_SNAPSHOT_PATH else None
+
+# Intentos de refresco cuando una invalidación descarta la lectura en curso
+MAX_INTENTOS_REFRESCO = 3
+
+
+def refresh_snapshot(blocking):
+    """
+    Refresca el snapshot desde Google Sheets. Un lock de archivo garantiza
+    que solo un proceso del host consulte la hoja a la vez; los demás siguen
+    usando la versión vigente.
+
+    Returns:
+        SnapshotView: La vista publicada, o None si otro proceso está refrescando
+    """
+    with open(f"{TASAS_SNAPSHOT_PATH}.lock", 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        try:
+            for _ in range(MAX_INTENTOS_REFRESCO):
+                # Otro proceso pudo publicar mientras esperábamos el lock
+                view = _reader.current()
+                epoch = read_epoch()
+                if view is not None and view.epoch == epoch and view.age() < TASAS_SNAPSHOT_TTL:
+                    return view
+
+                # La generación se basa en el reloj para seguir creciendo aunque el archivo se elimine
+                generation = max(time.time_ns(), view.generation + 1 if view is not None else 0)
+                tmp_path = write_snapshot(TASAS_SNAPSHOT_PATH, get_tasas_from_sheet(), generation, epoch)
+
+                with _epoch as epoch_file:
+                    if epoch_file.leer() == epoch:
+                        os.replace(tmp_path, TASAS_SNAPSHOT_PATH)
+                        return _reader.current()
+                # Hubo una modificación durante la lectura: se descarta y se vuelve a leer
+                os.unlink(tmp_path)
+            return None
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_snapshot_view():
+    """
+    Obtiene la vista vigente del snapshot compartido, refrescándola si venció.
+    Retorna None si el snapshot compartido no está habilitado.
+    """
+    if _reader is None:
+        return None
+
+    try:
+        view = _reader.current()
+        if view is None:
+            view = refresh_snapshot(blocking=True)
+            if view is None:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Las tasas se están modificando, intente nuevamente",
+                    headers={"Retry-After": "1"}
+                )
+            return view
+        if view.age() >= TASAS_SNAPSHOT_TTL:
+            return refresh_snapshot(blocking=False) or view
+        return view
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al leer el snapshot de tasas: {str(e)}"
+        )
+
+
+def get_tasas_snapshot():
+    """
+    Obtiene las tasas desde el snapshot compartido si está habilitado,
+    o directamente desde Google Sheets en caso contrario.
+    """
+    view = get_snapshot_view()
+    if view is None:
+        return get_tasas_from_sheet()
+    return list(view)
+
+
+def iter_tasas_snapshot():
+    """
+    Itera las tasas sin construir la lista completa: desde el archivo mapeado
+    si el snapshot compartido está habilitado, o desde las filas de Google
+    Sheets en caso contrario.
+    """
+    view = get_snapshot_view()
+    if view is None:
+        return iter_tasas_from_sheet()
+    return iter(view)
+
+
+def invalidate_snapshot():
+    """
+    Descarta el snapshot publicado tras una modificación, para que la próxima
+    lectura lo reconstruya. Los lectores que ya lo tienen mapeado no se ven afectados.
+    Incrementa la época de invalidación, lo que también descarta cualquier
+    refresco que haya leído la hoja antes de la modificación.
+
+    Returns:
+        int: La nueva época, o None si el snapshot no está habilitado
+    """
+    if _epoch is None:
+        return None
+    with _epoch as epoch_file:
+        epoch = epoch_file.incrementar()
+        try:
+            os.unlink(TASAS_SNAPSHOT_PATH)
+        except FileNotFoundError:
+            pass
+    return epoch
@@ -0,0 +1,326 @@
+import os
+import time
+import random
+import threading
+from fastapi import HTTPException
+from .google_sheets import get_tasas_from_sheet
+from .snapshot import get_snapshot_view, read_epoch
+
+# Segundos tras los cuales se recalculan los agregados desde Google Sheets
+# (solo si el snapshot compartido no está habilitado). Sin snapshot, cada
+# worker solo ve sus propias modificaciones hasta que vence este plazo.
+TASAS_STATS_TTL = float(os.getenv('TASAS_STATS_TTL', '300'))
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def email_domain(email):
+    """Dominio del email, o None si no tiene formato válido"""
+    if not email or '@' not in email:
+        return None
+    dominio = email.split('@')[1].strip().lower()
+    return dominio if '.' in dominio else None
+
+
+class Nodo:
+    """Nodo del treap: un valor distinto, sus repeticiones y el tamaño de su subárbol"""
+
+    __slots__ = ('valor', 'prioridad', 'repeticiones', 'tamano', 'izquierdo', 'derecho')
+
+    def __init__(self, valor, repeticiones=1):
+        self.valor = valor
+        self.prioridad = random.random()
+        self.repeticiones = repeticiones
+        self.tamano = repeticiones
+        self.izquierdo = None
+        self.derecho = None
+
+    def actualizar(self):
+        self.tamano = (self.repeticiones
+                       + (self.izquierdo.tamano if self.izquierdo else 0)
+                       + (self.derecho.tamano if self.derecho else 0))
+
+
+def _rotar_derecha(nodo):
+    hijo = nodo.izquierdo
+    nodo.izquierdo = hijo.derecho
+    hijo.derecho = nodo
+    nodo.actualizar()
+    hijo.actualizar()
+    return hijo
+
+
+def _rotar_izquierda(nodo):
+    hijo = nodo.derecho
+    nodo.derecho = hijo.izquierdo
+    hijo.izquierdo = nodo
+    nodo.actualizar()
+    hijo.actualizar()
+    return hijo
+
+
+def _insertar(nodo, valor):
+    if nodo is None:
+        return Nodo(valor)
+    if valor == nodo.valor:
+        nodo.repeticiones += 1
+    elif valor < nodo.valor:
+        nodo.izquierdo = _insertar(nodo.izquierdo, valor)
+        if nodo.izquierdo.prioridad > nodo.prioridad:
+            return _rotar_derecha(nodo)
+    else:
+        nodo.derecho = _insertar(nodo.derecho, valor)
+        if nodo.derecho.prioridad > nodo.prioridad:
+            return _rotar_izquierda(nodo)
+    nodo.actualizar()
+    return nodo
+
+
+def _unir(izquierdo, derecho):
+    """Une dos treaps cuyos valores están en orden (todos los de `izquierdo` son menores)"""
+    if izquierdo is None:
+        return derecho
+    if derecho is None:
+        return izquierdo
+    if izquierdo.prioridad > derecho.prioridad:
+        izquierdo.derecho = _unir(izquierdo.derecho, derecho)
+        izquierdo.actualizar()
+        return izquierdo
+    derecho.izquierdo = _unir(izquierdo, derecho.izquierdo)
+    derecho.actualizar()
+    return derecho
+
+
+def _quitar(nodo, valor):
+    """Quita una repetición de un valor presente en el treap"""
+    if valor < nodo.valor:
+        nodo.izquierdo = _quitar(nodo.izquierdo, valor)
+    elif valor > nodo.valor:
+        nodo.derecho = _quitar(nodo.derecho, valor)
+    elif nodo.repeticiones > 1:
+        nodo.repeticiones -= 1
+    else:
+        return _unir(nodo.izquierdo, nodo.derecho)
+    nodo.actualizar()
+    return nodo
+
+
+def _construir(ordenados):
+    """
+    Arma el treap en O(n) a partir de valores ordenados, insertando cada nodo
+    por el borde derecho del árbol (construcción de un árbol cartesiano).
+    """
+    pila = []
+    for valor in ordenados:
+        if pila and pila[-1].valor == valor:
+            pila[-1].repeticiones += 1
+            continue
+        nodo = Nodo(valor)
+        ultimo = None
+        while pila and pila[-1].prioridad < nodo.prioridad:
+            ultimo = pila.pop()
+        nodo.izquierdo = ultimo
+        if pila:
+            pila[-1].derecho = nodo
+        pila.append(nodo)
+
+    if not pila:
+        return None
+    # Los tamaños se calculan desde las hojas hacia la raíz
+    orden = []
+    pendientes = [pila[0]]
+    while pendientes:
+        nodo = pendientes.pop()
+        orden.append(nodo)
+        pendientes.extend(hijo for hijo in (nodo.izquierdo, nodo.derecho) if hijo is not None)
+    for nodo in reversed(orden):
+        nodo.actualizar()
+    return pila[0]
+
+
+class Agregado:
+    """
+    Cantidad, suma y valores ordenados de un grupo de tasas.
+
+    Los valores se guardan en un treap (árbol binario de búsqueda con
+    prioridades aleatorias) que mantiene el tamaño de cada subárbol, por lo que
+    agregar, quitar y obtener el k-ésimo valor toman O(log n) esperado.
+    """
+
+    def __init__(self, valores=()):
+        ordenados = sorted(valores)
+        self.suma = float(sum(ordenados))
+        self.raiz = _construir(ordenados)
+
+    def __len__(self):
+        return self.raiz.tamano if self.raiz is not None else 0
+
+    def __contains__(self, tasa):
+        nodo = self.raiz
+        while nodo is not None:
+            if tasa == nodo.valor:
+                return True
+            nodo = nodo.izquierdo if tasa < nodo.valor else nodo.derecho
+        return False
+
+    def agregar(self, tasa):
+        self.suma += tasa
+        self.raiz = _insertar(self.raiz, tasa)
+
+    def quitar(self, tasa):
+        if tasa in self:
+            self.raiz = _quitar(self.raiz, tasa)
+            self.suma -= tasa
+
+    def valor(self, k):
+        """k-ésimo valor en orden ascendente (desde 0)"""
+        nodo = self.raiz
+        while True:
+            izquierdo = nodo.izquierdo.tamano if nodo.izquierdo else 0
+            if k < izquierdo:
+                nodo = nodo.izquierdo
+            elif k < izquierdo + nodo.repeticiones:
+                return nodo.valor
+            else:
+                k -= izquierdo + nodo.repeticiones
+                nodo = nodo.derecho
+
+    def percentil(self, p):
+        # Interpolación lineal entre los rangos más cercanos
+        posicion = (len(self) - 1) * p / 100
+        inferior = int(posicion)
+        superior = min(inferior + 1, len(self) - 1)
+        fraccion = posicion - inferior
+        valor_inferior = self.valor(inferior)
+        return valor_inferior + (self.valor(superior) - valor_inferior) * fraccion
+
+    def resumen(self):
+        cantidad = len(self)
+        if cantidad == 0:
+            return {"cantidad": 0, "promedio": None, "minimo": None, "maximo": None, "percentiles": {}}
+        return {
+            "cantidad": cantidad,
+            "promedio": self.suma / cantidad,
+            "minimo": self.valor(0),
+            "maximo": self.valor(cantidad - 1),
+            "percentiles": {f"p{p}": self.percentil(p) for p in PERCENTILES}
+        }
+
+
+class TasaStats:
+    """
+    Agregados de tasas (global y por dominio de email) que se calculan una vez
+    por snapshot y luego se actualizan con cada creación, actualización o
+    eliminación hecha a través de la API.
+
+    `version` es la época de invalidación del snapshot que reflejan. Cuando una
+    modificación local invalida el snapshot (época N), el cambio se aplica aquí
+    y los agregados pasan a la época N sin recalcularse, siempre que estuvieran
+    en la época N - 1; si otro worker modificó algo entretanto, se recalculan
+    desde el snapshot compartido.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.por_id = {}  # idOp -> (tasa, dominio)
+        self.total = Agregado()
+        self.dominios = {}
+        self.version = None
+        self.calculado_en = None
+
+    def reconstruir(self, tasas, version):
+        por_id = {}
+        valores_dominios = {}
+        for tasa in tasas:
+            dominio = email_domain(tasa.get('email'))
+            if dominio is None or tasa['idOp'] in por_id:
+                continue
+            por_id[tasa['idOp']] = (tasa['tasa'], dominio)
+            valores_dominios.setdefault(dominio, []).append(tasa['tasa'])
+
+        total = Agregado(tasa for tasa, _ in por_id.values())
+        dominios = {dominio: Agregado(valores) for dominio, valores in valores_dominios.items()}
+
+        with self.lock:
+            self.por_id, self.total, self.dominios = por_id, total, dominios
+            self.version = version
+            self.calculado_en = time.monotonic()
+
+    def _quitar(self, idOp):
+        anterior = self.por_id.pop(idOp, None)
+        if anterior is None:
+            return None
+        tasa, dominio = anterior
+        self.total.quitar(tasa)
+        grupo = self.dominios.get(dominio)
+        if grupo is not None:
+            grupo.quitar(tasa)
+            if not len(grupo):
+                del self.dominios[dominio]
+        return dominio
+
+    def _avanzar(self, epoch):
+        if epoch is not None and self.version == epoch - 1:
+            self.version = epoch
+
+    def upsert(self, idOp, tasa, email=None, epoch=None):
+        """
+        Registra la tasa de un idOp creado o actualizado. Si no se indica email,
+        se conserva el dominio que tenía el registro. `epoch` es la época que
+        produjo la invalidación del snapshot asociada a esta modificación.
+        """
+        with self.lock:
+            if self.version is None:
+                return  # Aún no se calculan los agregados
+            dominio_anterior = self._quitar(idOp)
+            dominio = email_domain(email) if email is not None else dominio_anterior
+            if dominio is not None:
+                self.por_id[idOp] = (tasa, dominio)
+                self.total.agregar(tasa)
+                self.dominios.setdefault(dominio, Agregado()).agregar(tasa)
+            self._avanzar(epoch)
+
+    def delete(self, idOp, epoch=None):
+        with self.lock:
+            if self.version is not None:
+                self._quitar(idOp)
+                self._avanzar(epoch)
+
+    def resumen(self, group_by=None):
+        with self.lock:
+            resultado = {"total": self.total.resumen()}
+            if group_by == "email_domain":
+                resultado["grupos"] = {
+                    dominio: grupo.resumen()
+                    for dominio, grupo in sorted(self.dominios.items())
+                }
+            return resultado
+
+
+tasa_stats = TasaStats()
+
+
+def get_stats(group_by=None):
+    """
+    Obtiene los agregados de tasas. Con el snapshot compartido habilitado se
+    recalculan desde el archivo mapeado solo cuando otro worker lo invalidó;
+    sin snapshot, cuando vence TASAS_STATS_TTL.
+    """
+    try:
+        epoch = read_epoch()
+        if epoch is not None:
+            if tasa_stats.version != epoch:
+                view = get_snapshot_view()
+                if tasa_stats.version != view.epoch:
+                    tasa_stats.reconstruir(view, view.epoch)
+        elif tasa_stats.calculado_en is None or time.monotonic() - tasa_stats.calculado_en >= TASAS_STATS_TTL:
+            tasa_stats.reconstruir(get_tasas_from_sheet(), 0)
+
+        return tasa_stats.resumen(group_by)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error al calcular las estadísticas: {str(e)}"
+        )
@@ -0,0 +1,161 @@
+import os
+import asyncio
+import itertools
+from fastapi import HTTPException, Depends
+from .auth import get_current_user
+
+# Límite global de solicitudes en curso (comparten el cupo de llamadas a Google Sheets)
+ADMISSION_TOTAL_CONCURRENCY = int(os.getenv('ADMISSION_TOTAL_CONCURRENCY', '16'))
+# Tiempo máximo de espera en cola antes de rechazar con 503
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', '10'))
+# Valor del header Retry-After (segundos) en las respuestas 503
+ADMISSION_RETRY_AFTER = os.getenv('ADMISSION_RETRY_AFTER', '1')
+
+# Clases de ruta: prioridad (menor se atiende primero), concurrencia y largo de cola por defecto
+ROUTE_CLASSES = {
+    "mutation": {"prioridad": 0, "concurrencia": 4, "cola": 16},
+    "login": {"prioridad": 0, "concurrencia": 8, "cola": 32},
+    "read": {"prioridad": 1, "concurrencia": 8, "cola": 32},
+    "bulk": {"prioridad": 2, "concurrencia": 1, "cola": 2},
+}
+
+
+class AdmissionController:
+    """
+    Controla cuántas solicitudes de cada clase de ruta se atienden a la vez.
+
+    Cada clase tiene un límite de concurrencia y una cola de espera acotada;
+    además existe un límite global. Cuando se libera un cupo se atiende primero
+    a la clase con mayor prioridad (por ejemplo, mutaciones antes que lecturas).
+    Las solicitudes que no caben en la cola, o que esperan más de
+    ADMISSION_MAX_WAIT, se rechazan con 503 y Retry-After.
+    """
+
+    def __init__(self, clases, total_concurrencia):
+        self.total_concurrencia = total_concurrencia
+        self.total_activos = 0
+        self.clases = {}
+        for nombre, config in clases.items():
+            prefijo = f"ADMISSION_{nombre.upper()}"
+            self.clases[nombre] = {
+                "prioridad": config["prioridad"],
+                "concurrencia": int(os.getenv(f"{prefijo}_CONCURRENCY", config["concurrencia"])),
+                "cola_maxima": int(os.getenv(f"{prefijo}_QUEUE", config["cola"])),
+                "activos": 0,
+                "en_cola": 0,
+                "admitidos": 0,
+                "rechazados": 0,
+            }
+        self.esperando = []  # (prioridad, orden de llegada, clase, future)
+        self.secuencia = itertools.count()
+
+    def puede_ejecutar(self, nombre):
+        clase = self.clases[nombre]
+        return (clase["activos"] < clase["concurrencia"]
+                and self.total_activos < self.total_concurrencia)
+
+    def admitir(self, nombre):
+        self.clases[nombre]["activos"] += 1
+        self.clases[nombre]["admitidos"] += 1
+        self.total_activos += 1
+
+    def rechazar(self, nombre, motivo):
+        self.clases[nombre]["rechazados"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail=f"Servicio saturado: {motivo}, intente nuevamente",
+            headers={"Retry-After": ADMISSION_RETRY_AFTER},
+        )
+
+    def despachar(self):
+        """Asigna los cupos libres a las solicitudes en espera, por prioridad"""
+        pendientes = []
+        for entrada in sorted(self.esperando):
+            _, _, nombre, future = entrada
+            if future.done():
+                continue
+            if self.puede_ejecutar(nombre):
+                self.clases[nombre]["en_cola"] -= 1
+                self.admitir(nombre)
+                future.set_result(True)
+            else:
+                pendientes.append(entrada)
+        self.esperando = pendientes
+
+    async def acquire(self, nombre):
+        clase = self.clases[nombre]
+        # Tras cada liberación se despachan los que esperan, así que si hay cupo
+        # no queda nadie en cola que pueda usarlo antes que esta solicitud
+        if self.puede_ejecutar(nombre):
+            self.admitir(nombre)
+            return
+
+        if clase["en_cola"] >= clase["cola_maxima"]:
+            self.rechazar(nombre, "cola de espera llena")
+
+        future = asyncio.get_running_loop().create_future()
+        self.esperando.append((clase["prioridad"], next(self.secuencia), nombre, future))
+        clase["en_cola"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), ADMISSION_MAX_WAIT)
+        except asyncio.TimeoutError:
+            if future.done():
+                return  # El cupo se asignó justo al vencer el plazo
+            future.cancel()
+            clase["en_cola"] -= 1
+            self.rechazar(nombre, "tiempo de espera agotado")
+        except asyncio.CancelledError:
+            # El cliente se desconectó mientras esperaba
+            if future.done() and not future.cancelled():
+                self.release(nombre)
+            else:
+                future.cancel()
+                clase["en_cola"] -= 1
+            raise
+
+    def release(self, nombre):
+        self.clases[nombre]["activos"] -= 1
+        self.total_activos -= 1
+        self.despachar()
+
+    def stats(self):
+        return {
+            "total_activos": self.total_activos,
+            "total_concurrencia": self.total_concurrencia,
+            "clases": {
+                nombre: {clave: valor for clave, valor in clase.items() if clave != "prioridad"}
+                for nombre, clase in self.clases.items()
+            }
+        }
+
+
+controller = AdmissionController(ROUTE_CLASSES, ADMISSION_TOTAL_CONCURRENCY)
+
+
+def admission(nombre: str, autenticar: bool = True):
+    """
+    Dependencia que reserva un cupo de la clase de ruta indicada
+    durante la atención de la solicitud.
+
+    Por defecto el token se valida antes de reservar el cupo, para que las
+    solicitudes sin autenticar no ocupen las colas de los usuarios reales.
+    Solo el login, que no lleva token, usa autenticar=False.
+    """
+    if nombre not in controller.clases:
+        raise ValueError(f"Clase de ruta desconocida: {nombre}")
+
+    async def sin_autenticar():
+        await controller.acquire(nombre)
+        try:
+            yield
+        finally:
+            controller.release(nombre)
+
+    async def autenticada(current_user: dict = Depends(get_current_user)):
+        await controller.acquire(nombre)
+        try:
+            yield
+        finally:
+            controller.release(nombre)
+
+    return autenticada if autenticar else sin_autenticar
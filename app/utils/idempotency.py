@@ -0,0 +1,212 @@
+import os
+import time
+import json
+import fcntl
+import asyncio
+import hashlib
+from collections import OrderedDict
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+# Segundos que se conserva la respuesta asociada a una clave de idempotencia
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', '86400'))
+# Cantidad máxima de claves almacenadas (se descartan las más antiguas)
+IDEMPOTENCY_MAX_KEYS = int(os.getenv('IDEMPOTENCY_MAX_KEYS', '10000'))
+# Directorio compartido por los workers para las claves de idempotencia. Si no
+# se define, cada proceso solo deduplica las solicitudes que él mismo recibe.
+IDEMPOTENCY_PATH = os.getenv('IDEMPOTENCY_PATH')
+# Cada cuántas escrituras se eliminan los archivos de claves vencidas
+IDEMPOTENCY_PURGE_EVERY = 1000
+
+
+def fingerprint(*partes) -> str:
+    """Huella de la solicitud, para detectar claves reutilizadas con otro contenido"""
+    contenido = json.dumps(partes, sort_keys=True, default=str)
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+def clave_reutilizada():
+    return HTTPException(
+        status_code=422,
+        detail="La clave de idempotencia ya fue usada con una solicitud distinta"
+    )
+
+
+class IdempotencyStore:
+    """
+    Almacén acotado en memoria de respuestas por clave de idempotencia.
+
+    Cada entrada guarda la huella de la solicitud y un future con su resultado.
+    Las repeticiones de una clave esperan ese future, por lo que no vuelven a
+    ejecutar la operación aunque lleguen mientras la primera sigue en curso.
+    Los errores 5xx no se guardan para permitir reintentos.
+
+    Con `path`, cada clave tiene además un archivo en ese directorio, que se
+    mantiene bloqueado mientras la operación está en curso: una repetición que
+    llega a otro worker espera el lock y responde con el resultado guardado.
+    """
+
+    def __init__(self, ttl, max_keys, path=None):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.entradas = OrderedDict()  # clave -> (huella, vencimiento, future)
+        self.path = path
+        self.escrituras = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def purgar(self):
+        ahora = time.monotonic()
+        while self.entradas:
+            clave, (_, vencimiento, _) = next(iter(self.entradas.items()))
+            if vencimiento > ahora and len(self.entradas) <= self.max_keys:
+                break
+            self.entradas.popitem(last=False)
+
+    def ruta(self, clave):
+        nombre = hashlib.sha256(json.dumps(clave).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, f"{nombre}.json")
+
+    def reservar(self, clave):
+        """
+        Abre y bloquea el archivo de la clave, esperando si otro proceso la
+        está procesando.
+
+        Returns:
+            tuple: (archivo, entrada guardada o None si no existe o venció)
+        """
+        archivo = os.fdopen(os.open(self.ruta(clave), os.O_RDWR | os.O_CREAT, 0o644), 'r+b')
+        try:
+            fcntl.flock(archivo, fcntl.LOCK_EX)
+            contenido = archivo.read()
+        except BaseException:
+            archivo.close()
+            raise
+        try:
+            entrada = json.loads(contenido) if contenido else None
+        except ValueError:
+            entrada = None  # Escritura interrumpida: se trata como clave nueva
+        if entrada is not None and entrada["vencimiento"] <= time.time():
+            entrada = None
+        return archivo, entrada
+
+    def guardar(self, archivo, entrada):
+        entrada["vencimiento"] = time.time() + self.ttl
+        archivo.seek(0)
+        archivo.truncate()
+        archivo.write(json.dumps(entrada, default=str).encode('utf-8'))
+        archivo.flush()
+        os.fsync(archivo.fileno())
+
+        self.escrituras += 1
+        if self.escrituras % IDEMPOTENCY_PURGE_EVERY == 0:
+            self.purgar_archivos()
+
+    def liberar(self, archivo):
+        fcntl.flock(archivo, fcntl.LOCK_UN)
+        archivo.close()
+
+    def purgar_archivos(self):
+        """Elimina los archivos de claves vencidas que ningún proceso tiene bloqueados"""
+        limite = time.time() - self.ttl
+        for nombre in os.listdir(self.path):
+            ruta = os.path.join(self.path, nombre)
+            try:
+                if os.path.getmtime(ruta) > limite:
+                    continue
+                with open(ruta, 'rb') as archivo:
+                    fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.unlink(ruta)
+            except (BlockingIOError, FileNotFoundError):
+                continue
+
+    async def ejecutar_compartida(self, clave, huella, operacion):
+        """Ejecuta la operación coordinándose con los demás workers a través del archivo de la clave"""
+        archivo, guardada = await run_in_threadpool(self.reservar, clave)
+        try:
+            if guardada is not None:
+                if guardada["huella"] != huella:
+                    raise clave_reutilizada()
+                if guardada["estado"] == "error":
+                    raise HTTPException(
+                        status_code=guardada["status_code"],
+                        detail=guardada["detail"],
+                        headers=guardada["headers"]
+                    )
+                return guardada["resultado"], True
+
+            try:
+                resultado = await operacion()
+            except HTTPException as he:
+                if he.status_code < 500:
+                    await run_in_threadpool(self.guardar, archivo, {
+                        "huella": huella,
+                        "estado": "error",
+                        "status_code": he.status_code,
+                        "detail": he.detail,
+                        "headers": he.headers
+                    })
+                raise he
+            await run_in_threadpool(self.guardar, archivo, {
+                "huella": huella,
+                "estado": "ok",
+                "resultado": resultado
+            })
+            return resultado, False
+        finally:
+            self.liberar(archivo)
+
+    async def run(self, key, usuario, huella, operacion):
+        """
+        Ejecuta la operación una sola vez por clave.
+
+        Args:
+            key: Valor del header Idempotency-Key (None desactiva la deduplicación)
+            usuario: Usuario autenticado; las claves no se comparten entre usuarios
+            huella: Huella de la solicitud
+            operacion: Función asíncrona sin argumentos que realiza la operación
+
+        Returns:
+            tuple: (resultado, True si la respuesta proviene del almacén)
+        """
+        if key is None:
+            return await operacion(), False
+
+        clave = (usuario, key)
+        self.purgar()
+        entrada = self.entradas.get(clave)
+
+        if entrada is not None:
+            huella_guardada, _, future = entrada
+            if huella_guardada != huella:
+                raise clave_reutilizada()
+            estado, valor = await asyncio.shield(future)
+            if estado == "error":
+                raise valor
+            return valor, True
+
+        future = asyncio.get_running_loop().create_future()
+        self.entradas[clave] = (huella, time.monotonic() + self.ttl, future)
+        try:
+            if self.path:
+                resultado, repetida = await self.ejecutar_compartida(clave, huella, operacion)
+            else:
+                resultado, repetida = await operacion(), False
+        except HTTPException as he:
+            if he.status_code >= 500:
+                self.entradas.pop(clave, None)
+            future.set_result(("error", he))
+            raise he
+        except BaseException as e:
+            self.entradas.pop(clave, None)
+            future.set_result(("error", HTTPException(
+                status_code=500,
+                detail="La solicitud original no finalizó, intente nuevamente"
+            )))
+            raise e
+
+        future.set_result(("ok", resultado))
+        return resultado, repetida
+
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_PATH)
@@ -0,0 +1,14 @@
+import os
+import sys
+from pathlib import Path
+
+# La app lee su configuración de variables de entorno al importarse
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ.setdefault('ALGORITHM', 'HS256')
+os.environ.setdefault('ACCESS_TOKEN_EXPIRE_MINUTES', '30')
+os.environ.setdefault('SPREADSHEET_ID', 'test-spreadsheet')
+
+# Las rutas cargan la documentación con una ruta relativa a la raíz del repositorio
+ROOT = Path(__file__).resolve().parent.parent
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
@@ -0,0 +1,114 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+from app import app
+from app.utils import admission
+from app.utils.auth import create_access_token
+
+
+def crear_controller(monkeypatch, total, **colas):
+    monkeypatch.setattr(admission, 'ADMISSION_MAX_WAIT', 0.5)
+    for nombre, cola in colas.items():
+        monkeypatch.setenv(f"ADMISSION_{nombre.upper()}_QUEUE", str(cola))
+    return admission.AdmissionController(admission.ROUTE_CLASSES, total)
+
+
+def test_mutaciones_se_atienden_antes_que_lecturas(monkeypatch):
+    controller = crear_controller(monkeypatch, 1)
+    orden = []
+
+    async def solicitud(nombre, etiqueta):
+        await controller.acquire(nombre)
+        orden.append(etiqueta)
+        await asyncio.sleep(0.01)
+        controller.release(nombre)
+
+    async def escenario():
+        primera = asyncio.create_task(solicitud("read", "r1"))
+        await asyncio.sleep(0)
+        lectura = asyncio.create_task(solicitud("read", "r2"))
+        await asyncio.sleep(0)
+        mutacion = asyncio.create_task(solicitud("mutation", "m1"))
+        await asyncio.gather(primera, lectura, mutacion)
+
+    asyncio.run(escenario())
+    assert orden == ["r1", "m1", "r2"]
+
+
+def test_cola_llena_responde_503_con_retry_after(monkeypatch):
+    controller = crear_controller(monkeypatch, 1, read=1)
+
+    async def escenario():
+        await controller.acquire("read")
+        en_espera = asyncio.create_task(controller.acquire("read"))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as exc:
+            await controller.acquire("read")
+        controller.release("read")
+        await en_espera
+        controller.release("read")
+        return exc.value
+
+    error = asyncio.run(escenario())
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == admission.ADMISSION_RETRY_AFTER
+    stats = controller.stats()["clases"]["read"]
+    assert stats["rechazados"] == 1
+    assert stats["admitidos"] == 2
+    assert stats["activos"] == 0 and stats["en_cola"] == 0
+
+
+def test_espera_vencida_responde_503(monkeypatch):
+    controller = crear_controller(monkeypatch, 1)
+    monkeypatch.setattr(admission, 'ADMISSION_MAX_WAIT', 0.01)
+
+    async def escenario():
+        await controller.acquire("bulk")
+        with pytest.raises(HTTPException) as exc:
+            await controller.acquire("bulk")
+        return exc.value
+
+    assert asyncio.run(escenario()).status_code == 503
+    assert controller.stats()["clases"]["bulk"]["en_cola"] == 0
+
+
+def test_solicitudes_sin_token_no_ocupan_cupos():
+    client = TestClient(app)
+    antes = admission.controller.stats()["clases"]["read"]["admitidos"]
+    respuesta = client.get("/api/tasas")
+    assert respuesta.status_code in (401, 403)
+    assert admission.controller.stats()["clases"]["read"]["admitidos"] == antes
+
+
+def test_estadisticas_de_admision_requieren_token():
+    client = TestClient(app)
+    assert client.get("/api/admission").status_code in (401, 403)
+    token = create_access_token({"sub": "admin"})
+    respuesta = client.get("/api/admission", headers={"Authorization": f"Bearer {token}"})
+    assert respuesta.status_code == 200
+    assert "read" in respuesta.json()["clases"]
+
+
+def test_importacion_rechazada_no_recibe_el_archivo(monkeypatch):
+    monkeypatch.setenv("ADMISSION_BULK_CONCURRENCY", "0")
+    monkeypatch.setattr(admission, 'controller', crear_controller(monkeypatch, 4, bulk=0))
+    formularios = []
+    form_original = Request.form
+
+    def form(self, *args, **kwargs):
+        formularios.append(1)
+        return form_original(self, *args, **kwargs)
+
+    monkeypatch.setattr(Request, 'form', form)
+    client = TestClient(app)
+    token = create_access_token({"sub": "admin"})
+    respuesta = client.post(
+        "/api/tasas/import",
+        headers={"Authorization": f"Bearer {token}"},
+        files={"archivo": ("tasas.csv", b"idOp,tasa,email\n1,1.5,a@b.cl\n", "text/csv")}
+    )
+    assert respuesta.status_code == 503
+    assert respuesta.headers["Retry-After"] == admission.ADMISSION_RETRY_AFTER
+    assert formularios == []
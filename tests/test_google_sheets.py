@@ -0,0 +1,160 @@
+import json
+import pytest
+from fastapi import HTTPException
+from app.services import google_sheets
+
+
+def test_load_shards_sin_configuracion_usa_hoja_tasas(monkeypatch):
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARDS', None)
+    shards = google_sheets.load_shards()
+    assert shards == [{"spreadsheet_id": "test-spreadsheet", "tab": "tasas", "min_id": None, "max_id": None}]
+
+
+def test_load_shards_lee_configuracion(monkeypatch):
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARDS', json.dumps([
+        {"spreadsheet_id": "a", "tab": "tasas 1", "max_id": 100},
+        {"tab": "tasas 2", "min_id": 101}
+    ]))
+    shards = google_sheets.load_shards()
+    assert shards[0] == {"spreadsheet_id": "a", "tab": "tasas 1", "min_id": None, "max_id": 100}
+    assert shards[1]["spreadsheet_id"] == "test-spreadsheet"
+
+
+@pytest.mark.parametrize("config", [
+    "no es json",
+    "[]",
+    '["tasas"]',
+    '[{"tab": "tasas!A:C"}]',
+    '[{"tab": "tasas", "min_id": "1"}]',
+])
+def test_load_shards_rechaza_configuracion_invalida(monkeypatch, config):
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARDS', config)
+    with pytest.raises(ValueError):
+        google_sheets.load_shards()
+
+
+@pytest.mark.parametrize("config", [
+    # Rangos solapados
+    '[{"tab": "a", "min_id": 1, "max_id": 100}, {"tab": "b", "min_id": 50, "max_id": 200}]',
+    # Dos shards abiertos hacia arriba
+    '[{"tab": "a", "min_id": 1}, {"tab": "b", "min_id": 101}]',
+    # Shard sin límites
+    '[{"tab": "a", "max_id": 100}, {"tab": "b"}]',
+    # min_id mayor que max_id
+    '[{"tab": "a", "max_id": 100}, {"tab": "b", "min_id": 300, "max_id": 200}]',
+])
+def test_load_shards_rechaza_rangos_invalidos(monkeypatch, config):
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARD_STRATEGY', 'range')
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARDS', config)
+    with pytest.raises(ValueError):
+        google_sheets.load_shards()
+
+
+def test_load_shards_acepta_rangos_contiguos(monkeypatch):
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARD_STRATEGY', 'range')
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARDS', json.dumps([
+        {"tab": "b", "min_id": 101},
+        {"tab": "a", "max_id": 100},
+    ]))
+    assert [s["tab"] for s in google_sheets.load_shards()] == ["b", "a"]
+
+
+def test_load_shards_rechaza_estrategia_desconocida(monkeypatch):
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARD_STRATEGY', 'rnage')
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARDS', None)
+    with pytest.raises(ValueError):
+        google_sheets.load_shards()
+
+
+def test_get_shard_for_idop_por_rango(monkeypatch):
+    shards = [
+        {"spreadsheet_id": "a", "tab": "t1", "min_id": None, "max_id": 100},
+        {"spreadsheet_id": "a", "tab": "t2", "min_id": 101, "max_id": 200},
+    ]
+    monkeypatch.setattr(google_sheets, 'SHARDS', shards)
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARD_STRATEGY', 'range')
+    assert google_sheets.get_shard_for_idop(5)['tab'] == 't1'
+    assert google_sheets.get_shard_for_idop(150)['tab'] == 't2'
+    with pytest.raises(HTTPException) as exc:
+        google_sheets.get_shard_for_idop(500)
+    assert exc.value.status_code == 400
+
+
+def test_get_shard_for_idop_por_hash(monkeypatch):
+    shards = [{"spreadsheet_id": "a", "tab": f"t{i}", "min_id": None, "max_id": None} for i in range(3)]
+    monkeypatch.setattr(google_sheets, 'SHARDS', shards)
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARD_STRATEGY', 'hash')
+    assert google_sheets.get_shard_for_idop(7)['tab'] == 't1'
+
+
+def test_a1_range_cita_el_nombre_de_la_pestana():
+    shard = {"tab": "tasas d'Chile"}
+    assert google_sheets.a1_range(shard) == "'tasas d''Chile'"
+    assert google_sheets.a1_range(shard, "B3") == "'tasas d''Chile'!B3"
+
+
+def test_get_sheet_id_no_usa_otra_pestana():
+    spreadsheet = {"sheets": [
+        {"properties": {"title": "otra", "sheetId": 1}},
+        {"properties": {"title": "tasas", "sheetId": 2}},
+    ]}
+    assert google_sheets.get_sheet_id(spreadsheet, "tasas") == 2
+    with pytest.raises(HTTPException) as exc:
+        google_sheets.get_sheet_id(spreadsheet, "Tasas")
+    assert exc.value.status_code == 500
+
+
+def test_get_tasas_from_sheet_conserva_primera_ocurrencia(monkeypatch):
+    valores = {
+        "t1": [["idOp", "tasa", "email"], ["1", "1.5", "a@b.cl"], ["2", "2.0", "c@d.cl"]],
+        "t2": [["IdOp", "Tasa", "Email"], ["2", "9.9", "x@y.cl"], ["3", "3.0", "e@f.cl"], ["x", "1", "z@z.cl"]],
+    }
+    shards = [{"spreadsheet_id": "a", "tab": tab, "min_id": None, "max_id": None} for tab in valores]
+    monkeypatch.setattr(google_sheets, 'SHARDS', shards)
+    monkeypatch.setattr(google_sheets, 'get_shard_values', lambda shard: valores[shard['tab']])
+    assert google_sheets.get_tasas_from_sheet() == [
+        {"idOp": 1, "tasa": 1.5, "email": "a@b.cl"},
+        {"idOp": 2, "tasa": 2.0, "email": "c@d.cl"},
+        {"idOp": 3, "tasa": 3.0, "email": "e@f.cl"},
+    ]
+
+
+def test_idop_exists_in_sheet_revisa_todos_los_shards(monkeypatch):
+    valores = {
+        "t0": [["idOp", "tasa", "email"], ["2", "1.5", "a@b.cl"]],
+        "t1": [["idOp", "tasa", "email"], ["4", "2.0", "c@d.cl"]],
+    }
+    shards = [{"spreadsheet_id": "a", "tab": tab, "min_id": None, "max_id": None} for tab in valores]
+    monkeypatch.setattr(google_sheets, 'SHARDS', shards)
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARD_STRATEGY', 'hash')
+    monkeypatch.setattr(google_sheets, 'get_shard_values', lambda shard: valores[shard['tab']])
+    # idOp 4 corresponde al shard t0, pero su fila quedó en t1
+    assert google_sheets.idop_exists_in_sheet(4)
+    assert not google_sheets.idop_exists_in_sheet(6)
+
+
+def test_iter_tasas_from_sheet_construye_las_tasas_al_iterar(monkeypatch):
+    valores = {
+        "t1": [["idOp", "tasa", "email"], ["1", "1.5", "a@b.cl"], ["2", "2.0", "c@d.cl"]],
+        "t2": [["idOp", "tasa", "email"], ["2", "9.9", "x@y.cl"], ["3", "3.0", "e@f.cl"]],
+    }
+    shards = [{"spreadsheet_id": "a", "tab": tab, "min_id": None, "max_id": None} for tab in valores]
+    monkeypatch.setattr(google_sheets, 'SHARDS', shards)
+    monkeypatch.setattr(google_sheets, 'get_shard_values', lambda shard: valores[shard['tab']])
+
+    tasas = google_sheets.iter_tasas_from_sheet()
+    assert not isinstance(tasas, list)
+    assert next(tasas) == {"idOp": 1, "tasa": 1.5, "email": "a@b.cl"}
+    assert list(tasas) == [
+        {"idOp": 2, "tasa": 2.0, "email": "c@d.cl"},
+        {"idOp": 3, "tasa": 3.0, "email": "e@f.cl"},
+    ]
+
+
+def test_iter_tasas_from_sheet_valida_encabezados_antes_de_iterar(monkeypatch):
+    shards = [{"spreadsheet_id": "a", "tab": "t1", "min_id": None, "max_id": None}]
+    monkeypatch.setattr(google_sheets, 'SHARDS', shards)
+    monkeypatch.setattr(google_sheets, 'get_shard_values', lambda shard: [["idOp", "tasa"], ["1", "1.5"]])
+    with pytest.raises(HTTPException) as exc:
+        google_sheets.iter_tasas_from_sheet()
+    assert exc.value.status_code == 500
@@ -0,0 +1,94 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from app.services import history
+
+
+HOJA = [
+    {"idOp": 1, "tasa": 1.5, "email": "a@x.com"},
+    {"idOp": 2, "tasa": 2.5, "email": "b@y.com"},
+]
+
+
+@pytest.fixture
+def lecturas(monkeypatch):
+    lecturas = []
+
+    def leer_hoja():
+        lecturas.append(1)
+        return list(HOJA)
+
+    monkeypatch.setattr(history, 'get_tasas_from_sheet', leer_hoja)
+    return lecturas
+
+
+@pytest.fixture
+def historial(tmp_path, monkeypatch):
+    path = str(tmp_path / "tasas.history")
+    monkeypatch.setattr(history, 'TASAS_HISTORY_PATH', path)
+    monkeypatch.setattr(history, '_log', None)
+    return history.get_history_log()
+
+
+def test_primera_actualizacion_conserva_el_valor_anterior(historial, lecturas):
+    # Las rutas registran el estado inicial antes de escribir en la hoja
+    history.ensure_history_baseline()
+    history.record_event(history.UPDATE, 1, 3.0)
+
+    eventos = history.get_tasa_history(1)
+    assert [e["operacion"] for e in eventos] == ["seed", "update"]
+    assert eventos[0]["tasa_anterior"] is None
+    assert eventos[1]["tasa"] == 3.0
+    assert eventos[1]["tasa_anterior"] == 1.5
+    assert eventos[1]["email"] == "a@x.com"
+
+    # El estado inicial se registra una sola vez
+    history.ensure_history_baseline()
+    assert len(lecturas) == 1
+
+
+def test_primera_eliminacion_conserva_los_datos_de_la_fila(historial, lecturas):
+    history.ensure_history_baseline()
+    history.record_event(history.DELETE, 2)
+
+    eliminacion = history.get_tasa_history(2)[-1]
+    assert eliminacion["operacion"] == "delete"
+    assert eliminacion["tasa"] == 2.5
+    assert eliminacion["tasa_anterior"] == 2.5
+    assert eliminacion["email"] == "b@y.com"
+
+
+def test_as_of_no_consulta_la_hoja(historial, lecturas):
+    assert history.get_tasas_as_of(datetime.now(timezone.utc)) == []
+    assert lecturas == []
+
+
+def test_as_of_reconstruye_el_estado_en_cada_fecha(historial, lecturas):
+    history.ensure_history_baseline()
+    inicio = datetime.now(timezone.utc)
+    history.record_event(history.CREATE, 3, 4.0, "c@z.com")
+    history.record_event(history.DELETE, 1)
+    history.record_event(history.UPDATE, 2, 9.0)
+
+    antes = datetime.now(timezone.utc) - timedelta(days=1)
+    assert history.get_tasas_as_of(antes) == []
+    # Registros posteriores a la fecha consultada se ignoran
+    despues = history.get_tasas_as_of(datetime.now(timezone.utc) + timedelta(seconds=1))
+    assert despues == [
+        {"idOp": 2, "tasa": 9.0, "email": "b@y.com"},
+        {"idOp": 3, "tasa": 4.0, "email": "c@z.com"},
+    ]
+    estado_inicial = history.HistoryLog(historial.path).estado_en(history.to_micros(inicio) - 1)
+    assert [t["idOp"] for t in estado_inicial] == [1, 2]
+    assert len(lecturas) == 1
+
+
+def test_error_del_historial_no_se_propaga(historial, monkeypatch):
+    def falla(*args):
+        raise OSError("disco lleno")
+
+    monkeypatch.setattr(history.HistoryLog, 'agregar', falla)
+    monkeypatch.setattr(history, 'get_tasas_from_sheet', lambda: list(HOJA))
+    history.ensure_history_baseline()
+    history.record_event(history.CREATE, 3, 4.0, "c@z.com")
+    history.record_upserts([(4, 1.0, "d@z.com")])
+    assert history.get_tasa_history(3) == []
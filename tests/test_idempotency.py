@@ -0,0 +1,204 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from app import app
+from app.routes import tasa as tasa_routes
+from app.utils.auth import create_access_token
+from app.utils.idempotency import IdempotencyStore, fingerprint
+
+
+def test_duplicados_concurrentes_esperan_el_primer_resultado():
+    store = IdempotencyStore(ttl=60, max_keys=10)
+    ejecuciones = []
+
+    async def operacion():
+        ejecuciones.append(1)
+        await asyncio.sleep(0.01)
+        return {"message": "ok"}
+
+    async def escenario():
+        return await asyncio.gather(*[
+            store.run("clave", "admin", fingerprint("create", 1), operacion) for _ in range(3)
+        ])
+
+    resultados = asyncio.run(escenario())
+    assert len(ejecuciones) == 1
+    assert resultados == [({"message": "ok"}, False), ({"message": "ok"}, True), ({"message": "ok"}, True)]
+
+
+def test_clave_reutilizada_con_otra_solicitud_responde_422():
+    store = IdempotencyStore(ttl=60, max_keys=10)
+
+    async def operacion():
+        return {"message": "ok"}
+
+    async def escenario():
+        await store.run("clave", "admin", fingerprint("create", 1), operacion)
+        await store.run("clave", "admin", fingerprint("create", 2), operacion)
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(escenario())
+    assert exc.value.status_code == 422
+
+
+def test_errores_5xx_no_se_guardan():
+    store = IdempotencyStore(ttl=60, max_keys=10)
+    intentos = []
+
+    async def operacion():
+        intentos.append(1)
+        if len(intentos) == 1:
+            raise HTTPException(status_code=500, detail="falla")
+        return {"message": "ok"}
+
+    async def escenario():
+        with pytest.raises(HTTPException):
+            await store.run("clave", "admin", "huella", operacion)
+        return await store.run("clave", "admin", "huella", operacion)
+
+    assert asyncio.run(escenario()) == ({"message": "ok"}, False)
+
+
+def test_claves_no_se_comparten_entre_usuarios():
+    store = IdempotencyStore(ttl=60, max_keys=10)
+    ejecuciones = []
+
+    async def operacion():
+        ejecuciones.append(1)
+        return {}
+
+    async def escenario():
+        await store.run("clave", "user1", "huella", operacion)
+        await store.run("clave", "user2", "huella", operacion)
+
+    asyncio.run(escenario())
+    assert len(ejecuciones) == 2
+
+
+def test_reintento_de_creacion_no_vuelve_a_escribir(monkeypatch):
+    inserciones = []
+    monkeypatch.setattr(tasa_routes, 'idop_exists_in_sheet', lambda idOp: bool(inserciones))
+    monkeypatch.setattr(tasa_routes, 'insert_tasa_in_sheet',
+                        lambda tasa: inserciones.append(tasa) or {"message": "Registro agregado correctamente"})
+
+    client = TestClient(app)
+    headers = {
+        "Authorization": f"Bearer {create_access_token({'sub': 'admin'})}",
+        "Idempotency-Key": "reintento-1",
+    }
+    body = {"idOp": 901, "tasa": 1.5, "email": "a@b.cl"}
+
+    primera = client.post("/api/tasas/create", json=body, headers=headers)
+    segunda = client.post("/api/tasas/create", json=body, headers=headers)
+
+    assert primera.status_code == segunda.status_code == 200
+    assert segunda.json() == primera.json()
+    assert segunda.headers["Idempotent-Replayed"] == "true"
+    assert len(inserciones) == 1
+
+
+
+def test_reintento_de_actualizacion_no_vuelve_a_escribir_ni_notificar(monkeypatch):
+    actualizaciones = []
+    notificaciones = []
+    monkeypatch.setattr(tasa_routes, 'update_tasa_in_sheet', lambda tasa: actualizaciones.append(tasa) or True)
+
+    class FakeZapier:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        async def post(self, url, json):
+            notificaciones.append(json)
+            return type("Respuesta", (), {"status_code": 200})()
+
+    monkeypatch.setattr(tasa_routes.httpx, 'AsyncClient', FakeZapier)
+
+    client = TestClient(app)
+    headers = {
+        "Authorization": f"Bearer {create_access_token({'sub': 'admin'})}",
+        "Idempotency-Key": "reintento-2",
+    }
+    body = {"tasa": 2.5, "email": "a@b.cl"}
+
+    primera = client.post("/api/tasas/902", json=body, headers=headers)
+    segunda = client.post("/api/tasas/902", json=body, headers=headers)
+
+    assert primera.status_code == segunda.status_code == 200
+    assert segunda.json() == primera.json()
+    assert segunda.headers["Idempotent-Replayed"] == "true"
+    assert len(actualizaciones) == 1
+    assert len(notificaciones) == 1
+
+
+def test_workers_comparten_las_claves(tmp_path):
+    # Dos almacenes sobre el mismo directorio simulan dos workers
+    worker_1 = IdempotencyStore(ttl=60, max_keys=10, path=str(tmp_path))
+    worker_2 = IdempotencyStore(ttl=60, max_keys=10, path=str(tmp_path))
+    ejecuciones = []
+
+    async def operacion():
+        ejecuciones.append(1)
+        return {"message": "ok"}
+
+    async def escenario():
+        primera = await worker_1.run("clave", "admin", "huella", operacion)
+        segunda = await worker_2.run("clave", "admin", "huella", operacion)
+        with pytest.raises(HTTPException) as exc:
+            await worker_2.run("clave", "admin", "otra huella", operacion)
+        return primera, segunda, exc.value.status_code
+
+    primera, segunda, status_code = asyncio.run(escenario())
+    assert primera == ({"message": "ok"}, False)
+    assert segunda == ({"message": "ok"}, True)
+    assert status_code == 422
+    assert len(ejecuciones) == 1
+
+
+def test_repeticion_en_otro_worker_espera_la_operacion_en_curso(tmp_path):
+    worker_1 = IdempotencyStore(ttl=60, max_keys=10, path=str(tmp_path))
+    worker_2 = IdempotencyStore(ttl=60, max_keys=10, path=str(tmp_path))
+    ejecuciones = []
+
+    async def escenario():
+        en_curso = asyncio.Event()
+        continuar = asyncio.Event()
+
+        async def operacion():
+            ejecuciones.append(1)
+            en_curso.set()
+            await continuar.wait()
+            return {"message": "ok"}
+
+        primera = asyncio.ensure_future(worker_1.run("clave", "admin", "huella", operacion))
+        await en_curso.wait()
+        segunda = asyncio.ensure_future(worker_2.run("clave", "admin", "huella", operacion))
+        await asyncio.sleep(0.05)
+        assert not segunda.done()
+        continuar.set()
+        return await primera, await segunda
+
+    assert asyncio.run(escenario()) == (({"message": "ok"}, False), ({"message": "ok"}, True))
+    assert len(ejecuciones) == 1
+
+
+def test_errores_4xx_se_comparten_entre_workers(tmp_path):
+    worker_1 = IdempotencyStore(ttl=60, max_keys=10, path=str(tmp_path))
+    worker_2 = IdempotencyStore(ttl=60, max_keys=10, path=str(tmp_path))
+
+    async def operacion():
+        raise HTTPException(status_code=400, detail="El ID de operación 1 ya existe")
+
+    async def escenario():
+        with pytest.raises(HTTPException):
+            await worker_1.run("clave", "admin", "huella", operacion)
+        with pytest.raises(HTTPException) as exc:
+            await worker_2.run("clave", "admin", "huella", operacion)
+        return exc.value
+
+    error = asyncio.run(escenario())
+    assert error.status_code == 400
+    assert error.detail == "El ID de operación 1 ya existe"
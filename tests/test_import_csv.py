@@ -0,0 +1,76 @@
+import io
+import pytest
+from fastapi import HTTPException
+from app.routes import tasa as tasa_routes
+from app.services import google_sheets
+
+
+class FakeSheets:
+    """Cliente de Google Sheets en memoria que registra los batchUpdate"""
+
+    def __init__(self, fallar_en=None):
+        self.lotes = []
+        self.fallar_en = fallar_en
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def batchUpdate(self, spreadsheetId, body):
+        if self.fallar_en is not None and len(self.lotes) == self.fallar_en:
+            raise RuntimeError("cuota excedida")
+        self.lotes.append(body['data'])
+        return self
+
+    def execute(self):
+        return {}
+
+
+@pytest.fixture
+def sheets(monkeypatch):
+    shards = [
+        {"spreadsheet_id": "a", "tab": "t1", "min_id": 1, "max_id": 100},
+        {"spreadsheet_id": "a", "tab": "t2", "min_id": 101, "max_id": 200},
+    ]
+    monkeypatch.setattr(google_sheets, 'SHARDS', shards)
+    monkeypatch.setattr(google_sheets, 'TASAS_SHARD_STRATEGY', 'range')
+    monkeypatch.setattr(google_sheets, 'get_shard_values', lambda shard: [["idOp", "tasa", "email"]])
+    fake = FakeSheets()
+    monkeypatch.setattr(google_sheets, 'authenticate_google_sheets', lambda: fake)
+    return fake
+
+
+def csv_bytes(*filas):
+    return io.BytesIO(("idOp,tasa,email\n" + "".join(f"{f}\n" for f in filas)).encode('utf-8'))
+
+
+def test_fila_sin_shard_se_rechaza_sin_detener_la_importacion(sheets):
+    resumen = tasa_routes.importar_csv(csv_bytes("3,1.5,a@b.cl", "500,2.0,c@d.cl", "4,3.0,e@f.cl"))
+    assert resumen['insertados'] == 2
+    assert resumen['rechazados'] == 1
+    assert resumen['errores'][0]['fila'] == 3
+    assert "500" in resumen['errores'][0]['errores'][0]
+
+
+def test_fila_invalida_se_rechaza(sheets):
+    resumen = tasa_routes.importar_csv(csv_bytes("3,1.5,a@b.cl", "-1,2.0,c@d.cl", "5,x,e@f.cl"))
+    assert resumen['insertados'] == 1
+    assert [e['fila'] for e in resumen['errores']] == [3, 4]
+
+
+def test_lote_fallido_informa_lo_ya_escrito(sheets, monkeypatch):
+    monkeypatch.setattr(tasa_routes, 'TASAS_IMPORT_CHUNK_SIZE', 2)
+    sheets.fallar_en = 1
+    with pytest.raises(HTTPException) as exc:
+        tasa_routes.importar_csv(csv_bytes("1,1.0,a@b.cl", "2,1.0,a@b.cl", "3,1.0,a@b.cl", "4,1.0,a@b.cl"))
+    assert exc.value.status_code == 500
+    assert exc.value.detail['resumen']['insertados'] == 2
+    assert "fila 5" in exc.value.detail['message']
+
+
+def test_archivo_sin_columnas_requeridas(sheets):
+    with pytest.raises(HTTPException) as exc:
+        tasa_routes.importar_csv(io.BytesIO(b"idOp,tasa\n1,2\n"))
+    assert exc.value.status_code == 400
@@ -0,0 +1,106 @@
+import os
+import threading
+import pytest
+from app.services import snapshot
+
+
+TASAS = [
+    {"idOp": 1, "tasa": 1.5, "email": "a@b.cl"},
+    {"idOp": 7, "tasa": 2.25, "email": "ñandú@ejemplo.com"},
+]
+
+
+@pytest.fixture
+def snapshot_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "tasas.snapshot")
+    monkeypatch.setattr(snapshot, 'TASAS_SNAPSHOT_PATH', path)
+    monkeypatch.setattr(snapshot, 'TASAS_SNAPSHOT_TTL', 60)
+    monkeypatch.setattr(snapshot, '_reader', snapshot.SnapshotReader(path))
+    monkeypatch.setattr(snapshot, '_epoch', snapshot.EpochFile(path))
+    return path
+
+
+@pytest.fixture
+def lecturas(monkeypatch):
+    lecturas = []
+
+    def leer_hoja():
+        lecturas.append(1)
+        return list(TASAS)
+
+    monkeypatch.setattr(snapshot, 'get_tasas_from_sheet', leer_hoja)
+    return lecturas
+
+
+def test_ida_y_vuelta_del_formato(snapshot_path, lecturas):
+    assert snapshot.get_tasas_snapshot() == TASAS
+    assert snapshot.get_tasas_snapshot() == TASAS
+    assert len(lecturas) == 1
+
+
+def test_nueva_version_reemplaza_el_mapeo(snapshot_path, lecturas):
+    anterior = snapshot.get_snapshot_view()
+    TASAS_NUEVAS = [{"idOp": 3, "tasa": 9.0, "email": "c@d.cl"}]
+    tmp_path = snapshot.write_snapshot(snapshot_path, TASAS_NUEVAS, anterior.generation + 1, anterior.epoch)
+    os.replace(tmp_path, snapshot_path)
+
+    nueva = snapshot.get_snapshot_view()
+    assert nueva is not anterior
+    assert nueva.generation == anterior.generation + 1
+    assert list(nueva) == TASAS_NUEVAS
+    # Quien ya tenía la vista anterior la sigue leyendo sin cambios
+    assert list(anterior) == TASAS
+
+
+def test_invalidacion_fuerza_reconstruccion(snapshot_path, lecturas):
+    snapshot.get_tasas_snapshot()
+    assert snapshot.invalidate_snapshot() == 1
+    snapshot.get_tasas_snapshot()
+    assert len(lecturas) == 2
+    assert snapshot.get_snapshot_view().epoch == 1
+
+
+def test_refresco_descarta_lectura_anterior_a_una_invalidacion(snapshot_path, monkeypatch):
+    hoja = {"tasas": list(TASAS)}
+    intentos = []
+
+    def leer_hoja():
+        datos = list(hoja["tasas"])
+        if not intentos:
+            # Una modificación termina mientras el refresco lee la hoja
+            hoja["tasas"] = [{"idOp": 1, "tasa": 9.0, "email": "a@b.cl"}]
+            snapshot.invalidate_snapshot()
+        intentos.append(1)
+        return datos
+
+    monkeypatch.setattr(snapshot, 'get_tasas_from_sheet', leer_hoja)
+    assert snapshot.get_tasas_snapshot() == [{"idOp": 1, "tasa": 9.0, "email": "a@b.cl"}]
+    assert len(intentos) == 2
+
+
+def test_sin_ruta_lee_directo_de_la_hoja(monkeypatch, lecturas):
+    monkeypatch.setattr(snapshot, '_reader', None)
+    monkeypatch.setattr(snapshot, '_epoch', None)
+    assert snapshot.get_tasas_snapshot() == TASAS
+    assert snapshot.invalidate_snapshot() is None
+
+
+def test_epoca_compartida_entre_hilos(snapshot_path):
+    errores = []
+
+    def invalidar():
+        try:
+            for _ in range(300):
+                snapshot.invalidate_snapshot()
+                snapshot.read_epoch()
+        except Exception as e:
+            errores.append(e)
+
+    hilos = [threading.Thread(target=invalidar) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert errores == []
+    assert snapshot.read_epoch() == 2400
@@ -0,0 +1,118 @@
+import random
+import pytest
+from app.services import snapshot, stats
+
+
+TASAS = [
+    {"idOp": 1, "tasa": 1.0, "email": "a@X.com"},
+    {"idOp": 2, "tasa": 3.0, "email": "b@y.com"},
+    {"idOp": 3, "tasa": 2.0, "email": "invalido"},
+    {"idOp": 4, "tasa": 5.0, "email": "c@x.com"},
+]
+
+
+@pytest.fixture
+def tasa_stats(monkeypatch):
+    instancia = stats.TasaStats()
+    monkeypatch.setattr(stats, 'tasa_stats', instancia)
+    return instancia
+
+
+@pytest.fixture
+def lecturas(monkeypatch):
+    lecturas = []
+
+    def leer_hoja():
+        lecturas.append(1)
+        return list(TASAS)
+
+    monkeypatch.setattr(snapshot, 'get_tasas_from_sheet', leer_hoja)
+    monkeypatch.setattr(stats, 'get_tasas_from_sheet', leer_hoja)
+    return lecturas
+
+
+@pytest.fixture
+def snapshot_habilitado(tmp_path, monkeypatch):
+    path = str(tmp_path / "tasas.snapshot")
+    monkeypatch.setattr(snapshot, 'TASAS_SNAPSHOT_PATH', path)
+    monkeypatch.setattr(snapshot, '_reader', snapshot.SnapshotReader(path))
+    monkeypatch.setattr(snapshot, '_epoch', snapshot.EpochFile(path))
+
+
+def test_agregados_por_dominio(tasa_stats, lecturas, monkeypatch):
+    monkeypatch.setattr(snapshot, '_epoch', None)
+    resultado = stats.get_stats("email_domain")
+    assert resultado["total"]["cantidad"] == 3
+    assert resultado["total"]["promedio"] == 3.0
+    assert resultado["total"]["percentiles"]["p50"] == 3.0
+    assert resultado["grupos"]["x.com"]["minimo"] == 1.0
+    assert resultado["grupos"]["x.com"]["maximo"] == 5.0
+
+
+def test_actualizaciones_incrementales(tasa_stats, lecturas, monkeypatch):
+    monkeypatch.setattr(snapshot, '_epoch', None)
+    stats.get_stats()
+    tasa_stats.upsert(2, 10.0)
+    tasa_stats.delete(1)
+    tasa_stats.upsert(9, 7.0, "z@x.com")
+    resultado = stats.get_stats("email_domain")
+    assert resultado["total"]["cantidad"] == 3
+    assert resultado["grupos"]["y.com"]["maximo"] == 10.0
+    assert resultado["grupos"]["x.com"]["minimo"] == 5.0
+    assert len(lecturas) == 1
+
+
+def test_modificacion_local_no_recalcula(tasa_stats, lecturas, snapshot_habilitado, monkeypatch):
+    stats.get_stats()
+    assert len(lecturas) == 1
+
+    epoch = snapshot.invalidate_snapshot()
+    tasa_stats.upsert(2, 10.0, epoch=epoch)
+    reconstrucciones = []
+    monkeypatch.setattr(tasa_stats, 'reconstruir', lambda *args: reconstrucciones.append(args))
+
+    assert stats.get_stats()["total"]["maximo"] == 10.0
+    assert reconstrucciones == []
+    assert len(lecturas) == 1
+
+
+def test_modificacion_de_otro_worker_recalcula_desde_el_snapshot(tasa_stats, lecturas, snapshot_habilitado):
+    stats.get_stats()
+    snapshot.invalidate_snapshot()  # Otro worker modificó la hoja
+    local = snapshot.invalidate_snapshot()
+    tasa_stats.upsert(2, 10.0, epoch=local)
+
+    # La época no es consecutiva: se recalcula desde el snapshot reconstruido
+    assert stats.get_stats()["total"]["maximo"] == 5.0
+    assert tasa_stats.version == local
+
+
+
+def profundidad(nodo):
+    if nodo is None:
+        return 0
+    return 1 + max(profundidad(nodo.izquierdo), profundidad(nodo.derecho))
+
+
+def test_agregado_coincide_con_lista_ordenada():
+    azar = random.Random(7)
+    referencia = [azar.choice([1.5, 2.0, 3.25]) if i % 3 == 0 else azar.uniform(0, 50) for i in range(500)]
+    agregado = stats.Agregado(referencia)
+
+    for _ in range(2000):
+        if referencia and azar.random() < 0.5:
+            tasa = azar.choice(referencia)
+            referencia.remove(tasa)
+            agregado.quitar(tasa)
+        else:
+            tasa = azar.choice([1.5, 2.0, 3.25, azar.uniform(0, 50)])
+            referencia.append(tasa)
+            agregado.agregar(tasa)
+    agregado.quitar(999.0)  # Valores ausentes se ignoran
+
+    ordenados = sorted(referencia)
+    assert len(agregado) == len(ordenados)
+    assert [agregado.valor(k) for k in range(len(ordenados))] == ordenados
+    assert agregado.suma == pytest.approx(sum(ordenados))
+    # Con prioridades aleatorias la altura se mantiene logarítmica
+    assert profundidad(agregado.raiz) < 60